@@ -39,9 +39,20 @@ def get_dataframe_row_cells(row):
     length = row['Length']
     return fcastL, fcastR, discL, discR, convL, convR, start, length
 
+class InstrumentType(enum.Enum):
+    DEPOSIT = 0
+    FUTURE = 1
+    ZERO_RATE = 2
+    TERM_DEPOSIT = 3
+    SWAP = 4
+    BASIS_SWAP = 5
+    CROSS_CURRENCY_SWAP = 6
+    MTM_CROSS_CURRENCY_BASIS_SWAP = 7
+
 class Instrument:
     def __init__(self, name):
         self.name_ = name
+        self.table_ = None
 
     def get_name(self):
         return self.name_
@@ -50,6 +61,14 @@ class Instrument:
         assert False, 'method must be implemented in child class %s' % type(self)
 
     def calc_par_rate(self, curvemap):
+        # Pricing formulas are implemented only by InstrumentTable, single instrument is priced as a table of one row
+        if self.table_ is None:
+            from instruments.instrument_table import InstrumentTable
+            self.table_ = InstrumentTable([self])
+        return self.table_.calc_par_rates(curvemap)[..., 0]
+
+    def get_table_row(self):
+        # Returns columns of the instrument in InstrumentTable (see instruments/instrument_table.py)
         assert False, 'method must be implemented in child class %s' % type(self)
 
     def drdp(self):
@@ -65,16 +65,9 @@ class BasisSwap(Instrument):
     def get_pillar_date(self):
         return self.end_
 
-    def calc_par_rate(self, curvemap):
-        # Price of instrument is basis which is added to "left" curve
-        fcurve_l = curvemap[self.curve_forecast_l_]
-        fcurve_r = curvemap[self.curve_forecast_r_]
-        dcurve = curvemap[self.curve_discount_]
-        rl = fcurve_l.get_fwd_rate_aligned(self.accruals_l_, ZEROFREQ, self.convention_l_.dcc)
-        rr = fcurve_r.get_fwd_rate_aligned(self.accruals_r_, ZEROFREQ, self.convention_r_.dcc)
-        df_l = dcurve.get_df(self.accruals_l_)
-        df_r = dcurve.get_df(self.accruals_r_)
-        nominator_l = sum(rl * self.dcf_l_ * df_l[1:])
-        nominator_r = sum(rr * self.dcf_r_ * df_r[1:])
-        denumerator = sum(self.dcf_l_ * df_l[1:])
-        return (nominator_r - nominator_l) / denumerator
+    def get_table_row(self):
+        return dict(type=InstrumentType.BASIS_SWAP,
+                    forecast_l=self.curve_forecast_l_, discount_l=self.curve_discount_,
+                    convention_l=self.convention_l_, schedule_l=self.accruals_l_,
+                    forecast_r=self.curve_forecast_r_, discount_r=self.curve_discount_,
+                    convention_r=self.convention_r_, schedule_r=self.accruals_r_)
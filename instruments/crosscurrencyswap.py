@@ -66,15 +66,8 @@ class CrossCurrencySwap(Instrument):
     def get_pillar_date(self):
         return self.end_
 
-    def calc_par_rate(self, curvemap):
-        fcurve_r = curvemap[self.curve_forecast_r_]
-        dcurve_l = curvemap[self.curve_discount_l_]
-        dcurve_r = curvemap[self.curve_discount_r_]
-        rr = fcurve_r.get_fwd_rate_aligned(self.accruals_r_, ZEROFREQ, self.convention_r_.dcc)
-        df_l = dcurve_l.get_df(self.accruals_l_)
-        df_r = dcurve_r.get_df(self.accruals_r_)
-        nominator_r = sum(rr * self.dcf_r_ * df_r[1:])
-        notional_r = df_r[0] - df_r[-1]
-        notional_l = df_l[0] - df_l[-1]
-        denumerator_l = sum(self.dcf_l_ * df_l[1:])
-        return (nominator_r - notional_r + notional_l) / denumerator_l
+    def get_table_row(self):
+        return dict(type=InstrumentType.CROSS_CURRENCY_SWAP,
+                    discount_l=self.curve_discount_l_, convention_l=self.convention_l_, schedule_l=self.accruals_l_,
+                    forecast_r=self.curve_forecast_r_, discount_r=self.curve_discount_r_,
+                    convention_r=self.convention_r_, schedule_r=self.accruals_r_)
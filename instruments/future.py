@@ -53,6 +53,7 @@ class Future(Instrument):
                  convention: Convention):
         super().__init__(name)
         self.curve_forecast = curve_forecast
+        self.convention_ = convention
         self.start_ = create_excel_date(start, trade_date)
         self.end_ = date_step(self.start_, length)
         self.accruals_ = np.array([self.start_, self.end_])
@@ -62,12 +63,9 @@ class Future(Instrument):
     def get_pillar_date(self):
         return self.end_
 
-    def calc_par_rate(self, curvemap):
-        curve = curvemap[self.curve_forecast]
-        df = curve.get_df(self.accruals_)
-        forward_rate = (df[0] / df[1] - 1) / self.dcf_
-        future_rate = forward_rate + self.convexity_
-        return future_rate
+    def get_table_row(self):
+        return dict(type=InstrumentType.FUTURE, forecast_l=self.curve_forecast, convention_l=self.convention_,
+                    schedule_l=self.accruals_, convexity=self.convexity_)
 
     def drdp(self):
         return -100
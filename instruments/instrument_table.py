@@ -0,0 +1,218 @@
+# Copyright © 2017 Ondrej Martinsky, All rights reserved
+# http://github.com/omartinsky/pybor
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from instruments.base_instrument import *
+
+instrument_record_dtype = np.dtype([
+    ('type', np.int8),  # InstrumentType value
+    ('forecast_l', np.int32), ('discount_l', np.int32), ('convention_l', np.int32), ('schedule_l', np.int32),
+    ('forecast_r', np.int32), ('discount_r', np.int32), ('convention_r', np.int32), ('schedule_r', np.int32),
+    ('start', np.int64),
+    ('end', np.int64),
+    ('convexity', np.float64),
+])
+
+
+class InstrumentTable:
+    """
+    Columnar store of instruments. Each instrument is one record of a structured array which refers to curves,
+    conventions and schedules by index (-1 when not set). Schedules of all legs share one ragged buffer of dates.
+    Par rates of all instruments are calculated at once, with a single discount factor lookup per curve.
+    """
+
+    def __init__(self, instruments):
+        self.names = [i.get_name() for i in instruments]
+        self.curve_names = []
+        self.conventions = []
+        schedules = []
+        # Columns are collected in lists first, assigning fields of single records is slow
+        columns = dict((field, []) for field in instrument_record_dtype.names)
+        for instrument in instruments:
+            row = instrument.get_table_row()
+            columns['type'].append(row['type'].value)
+            for leg in ['l', 'r']:
+                forecast = self.find_or_add(self.curve_names, row.get('forecast_' + leg))
+                discount = self.find_or_add(self.curve_names, row.get('discount_' + leg))
+                convention = self.find_or_add(self.conventions, row.get('convention_' + leg))
+                schedule = row.get('schedule_' + leg)
+                columns['forecast_' + leg].append(forecast)
+                columns['discount_' + leg].append(discount)
+                columns['convention_' + leg].append(convention)
+                columns['schedule_' + leg].append(-1 if schedule is None else len(schedules))
+                if schedule is not None:
+                    assert len(schedule) >= 2
+                    schedules.append((schedule, forecast, discount, convention))
+            columns['start'].append(row['schedule_l'][0])
+            columns['end'].append(instrument.get_pillar_date())
+            columns['convexity'].append(row.get('convexity', 0.))
+        self.records = np.zeros(len(instruments), dtype=instrument_record_dtype)
+        for field, values in columns.items():
+            self.records[field] = values
+        self.records.flags.writeable = False
+
+        # Quote conversions are linear, rate = a + b * price
+        self.rate_from_price_a = np.array([i.par_rate_from_price(0.) for i in instruments])
+        self.rate_from_price_b = np.array([i.par_rate_from_price(1.) for i in instruments]) - self.rate_from_price_a
+
+        # Ragged buffer of schedule dates, schedule i occupies dates[offsets[i]:offsets[i+1]]
+        lengths = np.array([len(s[0]) for s in schedules], dtype=np.int64)
+        self.schedule_offsets = np.zeros(len(schedules) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.schedule_offsets[1:])
+        self.schedule_dates = np.concatenate([s[0] for s in schedules]).astype(np.int64) if schedules else \
+            np.zeros(0, dtype=np.int64)
+        point_schedule = np.repeat(np.arange(len(schedules)), lengths)
+        point_forecast = np.array([s[1] for s in schedules], dtype=np.int64)[point_schedule]
+        point_discount = np.array([s[2] for s in schedules], dtype=np.int64)[point_schedule]
+        denominators = np.array([c.dcc.get_denominator() for c in self.conventions])
+        point_denominator = denominators[np.array([s[3] for s in schedules], dtype=np.int64)][point_schedule]
+
+        # Day count fraction of the period which ends at given point, zero at the first point of each schedule
+        self.first_points = self.schedule_offsets[:-1]
+        self.last_points = self.schedule_offsets[1:] - 1
+        self.previous_points = np.arange(len(self.schedule_dates)) - 1
+        self.previous_points[self.first_points] = self.first_points
+        self.not_first = np.ones(len(self.schedule_dates))
+        self.not_first[self.first_points] = 0.
+        self.dcfs = (self.schedule_dates - self.schedule_dates[self.previous_points]) / point_denominator
+
+        # Discount factors of each curve are looked up once on the union of dates of all its points
+        self.curve_lookups = []
+        for c in range(len(self.curve_names)):
+            forecast_points = np.flatnonzero(point_forecast == c)
+            discount_points = np.flatnonzero(point_discount == c)
+            points = np.concatenate([forecast_points, discount_points])
+            dates, inverse = np.unique(self.schedule_dates[points], return_inverse=True)
+            self.curve_lookups.append((dates, forecast_points, inverse[:len(forecast_points)],
+                                       discount_points, inverse[len(forecast_points):]))
+
+        # Points of right legs of MTM cross currency swaps, paired with points of left legs at the same position
+        mtm = self.records[self.records['type'] == InstrumentType.MTM_CROSS_CURRENCY_BASIS_SWAP.value]
+        lengths_l = lengths[mtm['schedule_l']]
+        assert np.all(lengths_l == lengths[mtm['schedule_r']]), "MTM swap legs must have the same schedule length"
+        offsets = np.repeat(np.cumsum(lengths_l) - lengths_l, lengths_l)
+        within = np.arange(np.sum(lengths_l)) - offsets
+        self.mtm_points_l = np.repeat(self.first_points[mtm['schedule_l']], lengths_l) + within
+        self.mtm_points_r = np.repeat(self.first_points[mtm['schedule_r']], lengths_l) + within
+
+    @staticmethod
+    def find_or_add(values, value) -> int:
+        if value is None:
+            return -1
+        for i, v in enumerate(values):
+            if v is value or v == value:
+                return i
+        values.append(value)
+        return len(values) - 1
+
+    def __len__(self):
+        return len(self.records)
+
+    def get_pillar_dates(self) -> np.ndarray:
+        return self.records['end']
+
+    def par_rates_from_prices(self, prices) -> np.ndarray:
+        # Prices are a dict (instrument name -> price) or an array ordered as self.names
+        if isinstance(prices, dict):
+            prices = np.array([prices[name] for name in self.names], dtype=np.float64)
+        return self.rate_from_price_a + self.rate_from_price_b * prices
+
+    def prices_from_par_rates(self, rates) -> np.ndarray:
+        return (rates - self.rate_from_price_a) / self.rate_from_price_b
+
+    def calc_point_dfs(self, curvemap):
+        # Forecast and discount factors at each point of the schedule buffer, 1 where the curve is not set
+        dff, dfd = None, None
+        for name, (dates, forecast_points, forecast_ix, discount_points, discount_ix) in zip(self.curve_names,
+                                                                                             self.curve_lookups):
+            dfs = np.asarray(curvemap[name].get_df(dates))
+            if dff is None:
+                dff = np.ones(dfs.shape[:-1] + self.schedule_dates.shape)
+                dfd = np.ones(dfs.shape[:-1] + self.schedule_dates.shape)
+            dff[..., forecast_points] = dfs[..., forecast_ix]
+            dfd[..., discount_points] = dfs[..., discount_ix]
+        return dff, dfd
+
+    def calc_par_rates(self, curvemap) -> np.ndarray:
+        # Returns par rates ordered as self.names
+        # (leading dimensions are kept when curves return discount factors with leading dimensions)
+        return self.calc_par_rates_and_annuities(curvemap)[0]
+
+    def calc_par_rates_and_annuities(self, curvemap):
+        # Annuity is the change of instrument PV per unit change of its rate (PV of the left leg with rate 1),
+        # so that a trade receiving rate K has PV = annuity * (K - par rate) per unit notional.
+        # Annuities of futures and zero rates, whose PV is not linear in the rate, are NaN.
+        dff, dfd = self.calc_point_dfs(curvemap)
+        prev = self.previous_points
+        # Forward rate times day count fraction of each period is dff[i-1] / dff[i] - 1
+        fwd_pv = self.not_first * (dff[..., prev] / dff - 1) * dfd
+        annuity = self.dcfs * dfd
+
+        first, last = self.first_points, self.last_points
+        sum_fwd_pv = np.add.reduceat(fwd_pv, first, axis=-1)
+        sum_annuity = np.add.reduceat(annuity, first, axis=-1)
+        notional = dfd[..., first] - dfd[..., last]
+
+        r = self.records
+        sl, sr = r['schedule_l'], r['schedule_r']
+        rates = np.zeros(dff.shape[:-1] + (len(r),))
+        annuities = np.full(dff.shape[:-1] + (len(r),), np.nan)
+        annuity_types = [t.value for t in [InstrumentType.TERM_DEPOSIT, InstrumentType.SWAP, InstrumentType.BASIS_SWAP,
+                                           InstrumentType.CROSS_CURRENCY_SWAP,
+                                           InstrumentType.MTM_CROSS_CURRENCY_BASIS_SWAP]]
+        mask = np.isin(r['type'], annuity_types)
+        annuities[..., mask] = sum_annuity[..., sl[mask]]
+        mask = r['type'] == InstrumentType.DEPOSIT.value
+        annuities[..., mask] = self.dcfs[last[sl[mask]]] * dff[..., last[sl[mask]]]
+
+        def set_rates(instrument_type, calc):
+            mask = r['type'] == instrument_type.value
+            if np.any(mask):
+                rates[..., mask] = calc(sl[mask], sr[mask], mask)
+
+        set_rates(InstrumentType.DEPOSIT, lambda l, _, m: (dff[..., first[l]] / dff[..., last[l]] - 1) /
+                                                          self.dcfs[last[l]])
+        set_rates(InstrumentType.FUTURE, lambda l, _, m: (dff[..., first[l]] / dff[..., last[l]] - 1) /
+                                                         self.dcfs[last[l]] + r['convexity'][m])
+        set_rates(InstrumentType.ZERO_RATE, lambda l, _, m: np.log(dff[..., first[l]] / dff[..., last[l]]) /
+                                                            self.dcfs[last[l]])
+        set_rates(InstrumentType.TERM_DEPOSIT, lambda l, _, m: (notional[..., l] - sum_fwd_pv[..., l]) /
+                                                               sum_annuity[..., l])
+        set_rates(InstrumentType.SWAP, lambda l, rr, m: sum_fwd_pv[..., rr] / sum_annuity[..., l])
+        set_rates(InstrumentType.BASIS_SWAP, lambda l, rr, m: (sum_fwd_pv[..., rr] - sum_fwd_pv[..., l]) /
+                                                              sum_annuity[..., l])
+        set_rates(InstrumentType.CROSS_CURRENCY_SWAP,
+                  lambda l, rr, m: (sum_fwd_pv[..., rr] - notional[..., rr] + notional[..., l]) / sum_annuity[..., l])
+
+        if len(self.mtm_points_r) > 0:
+            # Right leg notional resets to left leg notional converted at forward FX, dfd_l / dfd_r
+            pl, pr = self.mtm_points_l, self.mtm_points_r
+            ratio = np.ones(dfd.shape)
+            ratio[..., pr] = dfd[..., pl] / dfd[..., pr]
+            mtm_pv = self.not_first * (fwd_pv * ratio[..., prev] - (ratio - ratio[..., prev]) * dfd)
+            sum_mtm_pv = np.add.reduceat(mtm_pv, first, axis=-1)
+
+            def calc_mtm(l, rr, m):
+                npv_right = -dfd[..., first[rr]] + dfd[..., last[l]] + sum_mtm_pv[..., rr]
+                return (npv_right + notional[..., l] - sum_fwd_pv[..., l]) / sum_annuity[..., l]
+
+            set_rates(InstrumentType.MTM_CROSS_CURRENCY_BASIS_SWAP, calc_mtm)
+        return rates, annuities
@@ -68,22 +68,9 @@ class MtmCrossCurrencyBasisSwap(Instrument):
     def get_pillar_date(self):
         return self.end_
 
-    def calc_par_rate(self, curvemap):
-        fcurve_l = curvemap[self.curve_forecast_l_]
-        fcurve_r = curvemap[self.curve_forecast_r_]
-        dcurve_l = curvemap[self.curve_discount_l_]
-        dcurve_r = curvemap[self.curve_discount_r_]
-        rl = fcurve_l.get_fwd_rate_aligned(self.accruals_l_, ZEROFREQ, self.convention_l_.dcc)
-        rr = fcurve_r.get_fwd_rate_aligned(self.accruals_r_, ZEROFREQ, self.convention_r_.dcc)
-        df_l = dcurve_l.get_df(self.accruals_l_)
-        df_r = dcurve_r.get_df(self.accruals_r_)
-        dcf_l = self.dcf_l_
-        dcf_r = self.dcf_r_
-
-        npv_right = -df_r[0] \
-                    + df_r[-1] * df_l[-1] / df_r[-1] \
-                    + sum(rr * dcf_r * df_r[1:] * df_l[:-1] / df_r[:-1]) \
-                    - sum((df_l[1:] / df_r[1:] - df_l[:-1] / df_r[:-1]) * df_r[1:])
-
-        rate = (npv_right + df_l[0] - df_l[-1] - sum(rl * dcf_l * df_l[1:])) / sum(dcf_l * df_l[1:])
-        return rate
+    def get_table_row(self):
+        return dict(type=InstrumentType.MTM_CROSS_CURRENCY_BASIS_SWAP,
+                    forecast_l=self.curve_forecast_l_, discount_l=self.curve_discount_l_,
+                    convention_l=self.convention_l_, schedule_l=self.accruals_l_,
+                    forecast_r=self.curve_forecast_r_, discount_r=self.curve_discount_r_,
+                    convention_r=self.convention_r_, schedule_r=self.accruals_r_)
@@ -63,11 +63,9 @@ class Swap(Instrument):
     def get_pillar_date(self):
         return self.end_
 
-    def calc_par_rate(self, curvemap):
-        fcurve = curvemap[self.curve_forecast_]
-        dcurve = curvemap[self.curve_discount_]
-        r = fcurve.get_fwd_rate_aligned(self.accruals_float_, ZEROFREQ, self.convention_float_.dcc)
-        df = dcurve.get_df(self.accruals_fixed_)
-        nominator = sum(r * self.dcf_float_ * df[1:])
-        denumerator = sum(self.dcf_fixed_ * df[1:])
-        return nominator / denumerator
+    def get_table_row(self):
+        return dict(type=InstrumentType.SWAP,
+                    discount_l=self.curve_discount_, convention_l=self.convention_fixed_,
+                    schedule_l=self.accruals_fixed_,
+                    forecast_r=self.curve_forecast_, discount_r=self.curve_discount_,
+                    convention_r=self.convention_float_, schedule_r=self.accruals_float_)
@@ -56,14 +56,6 @@ class TermDeposit(Instrument):
     def get_pillar_date(self):
         return self.end_
 
-    def calc_par_rate(self, curvemap):
-        fcurve = curvemap[self.curve_forecast_]
-        dcurve = curvemap[self.curve_discount_]
-        r = fcurve.get_fwd_rate_aligned(self.accruals_, ZEROFREQ, self.convention_.dcc)
-        df = dcurve.get_df(self.accruals_)
-        nominator = sum(r * self.dcf_ * df[1:])
-        denumerator = sum(self.dcf_ * df[1:])
-        df_s = df[0]
-        df_e = df[-1]
-        price = (df_s - df_e - nominator) / denumerator
-        return price
+    def get_table_row(self):
+        return dict(type=InstrumentType.TERM_DEPOSIT, forecast_l=self.curve_forecast_,
+                    discount_l=self.curve_discount_, convention_l=self.convention_, schedule_l=self.accruals_)
@@ -44,6 +44,7 @@ class ZeroRate(Instrument):
                  convention: Convention):
         super().__init__(name)
         self.curve_forecast_ = curve_forecast
+        self.convention_ = convention
         self.start_ = create_excel_date(start, trade_date)
         self.end_ = date_step(self.start_, length)
         self.accruals_ = np.array([self.start_, self.end_])
@@ -52,7 +53,6 @@ class ZeroRate(Instrument):
     def get_pillar_date(self):
         return self.end_
 
-    def calc_par_rate(self, curvemap):
-        curve = curvemap[self.curve_forecast_]
-        df = curve.get_df(self.accruals_)
-        return np.log(df[0] / df[1]) / self.dcf_
+    def get_table_row(self):
+        return dict(type=InstrumentType.ZERO_RATE, forecast_l=self.curve_forecast_, convention_l=self.convention_,
+                    schedule_l=self.accruals_)
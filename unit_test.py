@@ -32,6 +32,22 @@ class EnumTests(unittest.TestCase):
         self.assertRaises(BaseException, enum_from_string, TestEnum, "C")
 
 
+class ImportTests(unittest.TestCase):
+    def test_import_budget(self):
+        # Fresh interpreter, so that modules imported by other tests do not count
+        import subprocess, sys
+        code = "import sys, time; t = time.perf_counter(); import yc_framework; t = time.perf_counter() - t; " \
+               "print(t, [m for m in ['pandas', 'scipy', 'matplotlib'] if m in sys.modules])"
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=dirname(__file__), text=True)
+        elapsed, heavy_modules = output.strip().split(' ', 1)
+        self.assertEqual(heavy_modules, '[]')
+        self.assertLess(float(elapsed), 2.0)
+        code = "import sys, yc_curvebuilder; yc_curvebuilder.CurveBuilder.parse_instrument_prices(None, {'A': 1.}); " \
+               "print('pandas' in sys.modules)"
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=dirname(__file__), text=True)
+        self.assertEqual(output.strip(), 'False')
+
+
 class DateTests(unittest.TestCase):
     def test_tenor(self):
         t = Tenor("3M")
@@ -43,6 +59,23 @@ class DateTests(unittest.TestCase):
         self.assertEqual(t.unit, 'M')
         self.assertEqual(t, t3)
 
+    def test_tenor_interning(self):
+        import pickle
+        t = Tenor("3M")
+        self.assertIs(t, Tenor("3M"))
+        self.assertIs(-t, Tenor("-3M"))
+        self.assertIs(-(-t), t)
+        self.assertIs(pickle.loads(pickle.dumps(t)), t)
+        self.assertEqual({t: 1}[Tenor("3M")], 1)
+        self.assertIsNone({'3M': 1}.get(t))
+        self.assertNotEqual(t, '3M')
+        self.assertRaises(BaseException, lambda: setattr(t, 'n', 6))
+        self.assertRaises(BaseException, lambda: Tenor("3X"))
+        from datetime import date
+        self.assertEqual(next_imm_date(date(2299, 12, 21)), date(2300, 3, 21))
+        numpy.testing.assert_array_equal(next_imm_dates(dte(date(2017, 3, 14)) + arr(0, 1), 2),
+                                         [dte(date(2017, 6, 21)), dte(date(2017, 9, 20))])
+
     def test_date_conversion(self):
         from datetime import date
         # Do not test dates before 1900/03/01, because excel incorrectly assumes 1900 is a leap year
@@ -108,6 +141,21 @@ class DateTests(unittest.TestCase):
         schedule = generate_schedule(dte('1996-01-20'), dte('1997-01-01'), Tenor("3M"), stub_type)
         self.assertListEqual(list(schedule), [35084, 35247, 35339, 35431])
 
+    def test_schedule_cache(self):
+        from datetime import date
+        schedule = generate_schedule(dte('1996-01-01'), dte('1997-01-01'), Tenor("3M"), BACK_STUB_SHORT)
+        self.assertIs(generate_schedule(dte('1996-01-01'), dte('1997-01-01'), Tenor("3M"), BACK_STUB_SHORT), schedule)
+        self.assertFalse(schedule.flags.writeable)
+        # Day of month once capped at the end of shorter month stays capped, like with repeated date_step
+        schedule = generate_schedule(dte(date(2017, 1, 31)), dte(date(2017, 5, 31)), Tenor("1M"), BACK_STUB_SHORT)
+        self.assertListEqual(list(schedule), [dte(date(2017, 1, 31)), dte(date(2017, 2, 28)), dte(date(2017, 3, 28)),
+                                              dte(date(2017, 4, 28)), dte(date(2017, 5, 28)), dte(date(2017, 5, 31))])
+        self.assertRaises(BaseException, lambda: generate_schedule(dte(date(2017, 1, 2)), dte(date(2017, 8, 1)),
+                                                                   Tenor("1F"), STUB_NOT_ALLOWED))
+        schedule = generate_schedule(dte(date(2017, 1, 2)), dte(date(2017, 8, 1)), Tenor("1F"), BACK_STUB_SHORT)
+        self.assertListEqual(list(schedule), [dte(date(2017, 1, 2)), dte(date(2017, 3, 15)), dte(date(2017, 6, 21)),
+                                              dte(date(2017, 8, 1))])
+
     def test_tenor(self):
         t = Tenor("-3M")
         self.assertEqual(t.unit, 'M')
@@ -149,6 +197,25 @@ class DateTests(unittest.TestCase):
         self.assertEqual(date_step(dte(date(2017, 3, 15)), Tenor('1F')), dte(date(2017, 6, 21)))
         self.assertEqual(date_step(dte(date(2017, 3, 15)), Tenor('2F')), dte(date(2017, 9, 20)))
 
+    def test_date_step_array(self):
+        from datetime import date
+        dates = arr(dte(date(2017, 2, 10)), dte(date(2017, 2, 28)), dte(date(2017, 3, 31)), dte(date(2016, 2, 29)))
+        for tenor in ['3M', '1Y', '-1Y', '1M', '-13M', '2Q', '1D', '-1D', '1F', '2F']:
+            for preserve_eom in [False, True] if tenor[-1] != 'F' else [False]:
+                expected = [date_step(int(d), Tenor(tenor), preserve_eom) for d in dates]
+                numpy.testing.assert_array_equal(date_step_array(dates, Tenor(tenor), preserve_eom), expected)
+        numpy.testing.assert_array_equal(date_step_array(dates, Tenor('1M'), preserve_eom=True),
+                                         [dte(date(2017, 3, 10)), dte(date(2017, 3, 31)), dte(date(2017, 4, 30)),
+                                          dte(date(2016, 3, 31))])
+        numpy.testing.assert_array_equal(date_step_tenors(dte(date(2017, 2, 28)), ['1D', '1M', '1Y'], True),
+                                         [dte(date(2017, 3, 31)), dte(date(2017, 3, 31)), dte(date(2018, 2, 28))])
+        numpy.testing.assert_array_equal(next_imm_dates(dates), [dte(date(2017, 3, 15)), dte(date(2017, 3, 15)),
+                                                                 dte(date(2017, 6, 21)), dte(date(2016, 3, 16))])
+        numpy.testing.assert_array_equal(exceldates_to_datetime64(dates), np.array(
+            ['2017-02-10', '2017-02-28', '2017-03-31', '2016-02-29'], dtype='datetime64[D]'))
+        numpy.testing.assert_array_equal(datetime64_to_exceldates(exceldates_to_datetime64(dates)), dates)
+        self.assertRaises(AssertionError, lambda: exceldates_to_datetime64([60]))
+
     def test_date_roll(self):
         from datetime import date
 
@@ -165,12 +232,41 @@ class DateTests(unittest.TestCase):
         self.assertEqual(date_roll(dte(date(2017, 2, 19)), P, wc), dte(date(2017, 2, 17)))
         self.assertEqual(date_roll(dte(date(2017, 2, 20)), P, wc), dte(date(2017, 2, 20)))
 
+        MF = RollType.MODIFIED_FOLLOWING
+        MP = RollType.MODIFIED_PRECEDING
+        self.assertEqual(date_roll(dte(date(2017, 4, 29)), MF, wc), dte(date(2017, 4, 28)))
+        self.assertEqual(date_roll(dte(date(2017, 2, 18)), MF, wc), dte(date(2017, 2, 20)))
+        self.assertEqual(date_roll(dte(date(2017, 4, 1)), MP, wc), dte(date(2017, 4, 3)))
+        self.assertEqual(date_roll(dte(date(2017, 2, 19)), MP, wc), dte(date(2017, 2, 17)))
+        self.assertEqual(date_roll(dte(date(2017, 2, 19)), RollType.NONE, wc), dte(date(2017, 2, 19)))
+        dates = dte(date(2017, 4, 28)) + arr(0, 1, 2, 3, 4)
+        numpy.testing.assert_array_equal(date_roll(dates, F, wc), dte(date(2017, 4, 28)) + arr(0, 3, 3, 3, 4))
+        numpy.testing.assert_array_equal(date_roll(dates, MF, wc), dte(date(2017, 4, 28)) + arr(0, 0, 0, 3, 4))
+        numpy.testing.assert_array_equal(date_roll(dates, P, wc), dte(date(2017, 4, 28)) + arr(0, 0, 0, 3, 4))
+
     def test_create_spot_date(self):
         from datetime import date
         d = dte(date(2017, 1, 12))  # Thursday
         d2 = calculate_spot_date(d, 3, WeekendCalendar())
         self.assertEqual(exceldate_to_pydate(d2), date(2017, 1, 17))
 
+    def test_business_days(self):
+        from datetime import date
+        cal = EnumeratedCalendar({dte(date(2017, 1, 16))})
+        d = dte(date(2017, 1, 12))  # Thursday
+        self.assertEqual(cal.add_business_days(d, 2), dte(date(2017, 1, 17)))
+        self.assertEqual(cal.add_business_days(dte(date(2017, 1, 17)), -1), dte(date(2017, 1, 13)))
+        self.assertEqual(cal.add_business_days(dte(date(2017, 1, 14)), 0), dte(date(2017, 1, 14)))
+        self.assertEqual(cal.count_business_days(d, dte(date(2017, 1, 19))), 4)
+        self.assertFalse(cal.is_business_day(dte(date(2017, 1, 16))))
+        trade_dates = d + arr(0, 1, 5, 6)
+        numpy.testing.assert_array_equal(calculate_spot_date(trade_dates, 2, cal),
+                                         [dte(date(2017, 1, 17)), dte(date(2017, 1, 18)), dte(date(2017, 1, 19)),
+                                          dte(date(2017, 1, 20))])
+        numpy.testing.assert_array_equal(cal.add_business_days(d, arr(1, 2, 3)),
+                                         [dte(date(2017, 1, 13)), dte(date(2017, 1, 17)), dte(date(2017, 1, 18))])
+        self.assertRaises(AssertionError, lambda: calculate_spot_date(dte(date(2017, 1, 16)), 2, cal))
+
     def test_calendar(self):
         from datetime import date
         cal = WeekendCalendar()
@@ -194,6 +290,59 @@ class DateTests(unittest.TestCase):
 
         lon_nyk = global_calendars.get("London+NewYork")
         assert isinstance(lon_nyk, EnumeratedCalendar)
+        self.assertIs(global_calendars.get("London+NewYork"), lon_nyk)
+
+        dates = dte(date(2017, 2, 15)) + arr(0, 1, 2, 3, 4, 5)
+        numpy.testing.assert_array_equal(cal12.is_holiday(dates), [False, True, True, True, True, False])
+        numpy.testing.assert_array_equal(cal.is_holiday(dates), [cal.is_holiday(d) for d in dates])
+        self.assertTrue(is_weekend(dte(date(2017, 2, 18))))
+        self.assertFalse(is_weekend(dte(date(2017, 2, 17))))
+
+        holiday = dte(date(2017, 2, 16))
+
+        class RuleCalendar(CalendarBase):
+            def is_holiday(self, d):
+                return is_weekend(d) or d == holiday
+
+        cal3 = RuleCalendar()
+        self.assertEqual(cal3.get_following_business_days(dte(date(2017, 2, 16))), dte(date(2017, 2, 17)))
+        self.assertEqual(cal3.add_business_days(dte(date(2017, 2, 15)), 2), dte(date(2017, 2, 20)))
+        self.assertRaises(AssertionError, lambda: CalendarBase().get_holiday_mask())
+
+    def test_calendar_files(self):
+        from datetime import date
+        import tempfile
+        with tempfile.TemporaryDirectory() as data_dir, tempfile.TemporaryDirectory() as cache_dir:
+            with open(join(data_dir, 'A.csv'), 'w') as f:
+                f.write("date,name\n2017-02-16,Holiday 1\n# comment\n2017-12-25,Christmas\n")
+            with open(join(data_dir, 'B.ics'), 'w') as f:
+                f.write("BEGIN:VCALENDAR\nBEGIN:VEVENT\nDTSTART;VALUE=DATE:20170217\nSUMMARY:Holiday 2\n"
+                        "END:VEVENT\nEND:VCALENDAR\n")
+            calendars = Calendars(data_dir)
+            self.assertEqual(len(calendars.dictionary), 0)
+            cal_a = calendars.get('A')
+            self.assertEqual(cal_a.get_holidays(), {dte(date(2017, 2, 16)), dte(date(2017, 12, 25))})
+            self.assertTrue(calendars.get('B').is_holiday(dte(date(2017, 2, 17))))
+            self.assertTrue(calendars.get('A+B').is_holiday(dte(date(2017, 2, 16))))
+            self.assertRaises(BaseException, lambda: calendars.get('C'))
+            self.assertEqual(sorted(os.listdir(data_dir)), ['A.csv', 'B.ics'])  # Nothing is cached without cache_dir
+
+            # Second instance reads the compiled cache
+            Calendars(data_dir, cache_dir).get('A')
+            cal_a2 = Calendars(data_dir, cache_dir).get('A')
+            self.assertIsInstance(cal_a2.get_holiday_mask(), numpy.memmap)
+            self.assertEqual(cal_a2.get_holidays(), cal_a.get_holidays())
+
+            # Changed source file is compiled again
+            with open(join(data_dir, 'A.csv'), 'a') as f:
+                f.write("2017-12-26\n")
+            self.assertTrue(Calendars(data_dir, cache_dir).get('A').is_holiday(dte(date(2017, 12, 26))))
+
+            # Calendar still loads when the compiled mask cannot be written
+            key = CalendarDiskCache.create_key(join(data_dir, 'B.ics'))
+            os.makedirs(CalendarDiskCache(cache_dir).get_path(key))
+            self.assertTrue(Calendars(data_dir, cache_dir).get('B').is_holiday(dte(date(2017, 2, 17))))
+            self.assertEqual([f for f in os.listdir(cache_dir) if f.endswith('.tmp')], [])
 
 
 class ConventionsTest(unittest.TestCase):
@@ -254,6 +403,74 @@ class InstrumentTests(unittest.TestCase):
                                       convention_r=Convention(Tenor("3M"), Tenor("3M"), Tenor("3M"), DCC.ACT360))
         aae(i.calc_par_rate(cm), -0.036300637792516029)
 
+    def test_instrument_table(self):
+        curve_builder = CurveBuilder('engine_test.xlsx', 42000)
+        curvemap = curve_builder.create_initial_curvemap(0.02)
+        conv = Convention(Tenor("3M"), Tenor("3M"), Tenor("3M"), DCC.ACT360)
+        conv6m = Convention(Tenor("6M"), Tenor("6M"), Tenor("6M"), DCC.ACT365)
+        mtm = MtmCrossCurrencyBasisSwap("MtmCrossCurrencyBasisSwap", 'USD/USD.OIS', 'USD.LIBOR.6M', 'USD.LIBOR.3M',
+                                        'USD.LIBOR.6M', 42000 + 1, 'E', Tenor('3Y'), conv, conv)
+        ccs = CrossCurrencySwap("CrossCurrencySwap", 'USD.LIBOR.6M', 'USD/USD.OIS', 'USD.LIBOR.3M', 42000, 'E',
+                                Tenor('4Y'), conv6m, conv)
+        swap = Swap("Swap6M3M", 'USD.LIBOR.3M', 'USD/USD.OIS', 42000, '1M', Tenor('5Y'), conv6m, conv)
+        zr = ZeroRate("ZeroRate", 'USD.LIBOR.3M', 42000, 'E', Tenor('2Y'), conv)
+        instruments = curve_builder.all_instruments + [mtm, ccs, swap, zr]
+        self.assertEqual(set(i.get_table_row()['type'] for i in instruments), set(InstrumentType))
+        table = InstrumentTable(instruments)
+        self.assertEqual(len(table), len(instruments))
+        self.assertEqual(table.names[-1], "ZeroRate")
+        numpy.testing.assert_array_equal(table.get_pillar_dates(), [i.get_pillar_date() for i in instruments])
+        # Single instruments are priced as tables of one row, rates must not depend on other rows of the table
+        aae(table.calc_par_rates(curvemap), [i.calc_par_rate(curvemap) for i in instruments], decimal=14)
+        prices = dict((i.get_name(), 99.) for i in instruments)
+        aae(table.par_rates_from_prices(prices), [i.par_rate_from_price(99.) for i in instruments])
+
+
+class PortfolioTests(unittest.TestCase):
+    def test_portfolio_pvs(self):
+        curve_builder = CurveBuilder('engine_test.xlsx', 42000)
+        cm = curve_builder.create_initial_curvemap(0.02)
+        conv3m = Convention(Tenor("3M"), Tenor("3M"), Tenor("3M"), DCC.ACT360)
+        conv6m = Convention(Tenor("6M"), Tenor("6M"), Tenor("6M"), DCC.ACT360)
+        portfolio = Portfolio()
+        portfolio.add_swap('Swap1', 'USD.LIBOR.3M', 'USD/USD.OIS', 42000, 'E', Tenor('5Y'), conv3m, conv3m, 1e6, .03)
+        portfolio.add_deposit('Deposit', 'USD.LIBOR.3M', 42000, '1M', Tenor('6M'), conv3m, -2e6, .01)
+        portfolio.add_basis_swap('Basis', 'USD/USD.OIS', 'USD.LIBOR.3M', 'USD.LIBOR.6M', 42000, 'E', Tenor('10Y'),
+                                 conv3m, conv6m, 5e6, .001)
+        portfolio.add_swap('Swap2', 'USD.LIBOR.3M', 'USD/USD.OIS', 42000, '1Y', Tenor('2Y'), conv3m, conv3m, -1e6, .02)
+        self.assertRaises(BaseException, lambda: portfolio.add_trade(curve_builder.get_instrument_by_name(
+            'USD.LIBOR.3M__Future__3F_3M'), 1e6, .02))
+        ccs = CrossCurrencySwap('CCS', 'USD.LIBOR.6M', 'USD/USD.OIS', 'USD.LIBOR.3M', 42000, 'E', Tenor('4Y'), conv6m,
+                                conv3m)
+        self.assertRaises(BaseException, lambda: portfolio.add_trade(ccs, 1e6, .02))
+        self.assertEqual(len(portfolio), 4)
+
+        pvs = portfolio.calc_pvs(cm)
+        swap = portfolio.instruments[0]
+        df = cm['USD/USD.OIS'].get_df(swap.accruals_fixed_)[1:]
+        fwd = cm['USD.LIBOR.3M'].get_fwd_rate_aligned(swap.accruals_float_, ZEROFREQ, DCC.ACT360)
+        aae(pvs[0] / 1e6, .03 * sum(swap.dcf_fixed_ * df) - sum(fwd * swap.dcf_float_ * df))
+        deposit = portfolio.instruments[1]
+        df = cm['USD.LIBOR.3M'].get_df(deposit.accruals_)
+        aae(pvs[1] / 2e6, df[0] - df[1] * (1 + .01 * deposit.dcf_))
+        for pv, instrument, notional, rate in zip(pvs, portfolio.instruments, portfolio.notionals, portfolio.rates):
+            self.assertEqual(np.sign(pv), np.sign(notional * (rate - instrument.calc_par_rate(cm))))
+
+        group_pvs = portfolio.calc_group_pvs(cm)
+        self.assertEqual(list(group_pvs.keys()), [('USD.LIBOR.3M',), ('USD.LIBOR.3M', 'USD.LIBOR.6M', 'USD/USD.OIS'),
+                                                  ('USD.LIBOR.3M', 'USD/USD.OIS')])
+        aae(group_pvs[('USD.LIBOR.3M', 'USD/USD.OIS')], pvs[0] + pvs[3])
+        aae(portfolio.calc_pv(cm), sum(pvs))
+        aae(portfolio.calc_pvs(cm, chunk_size=1), pvs)
+        aae(portfolio.calc_pvs(cm, processes=2), pvs)
+
+        # Basis swap with forecast curves swapped is in the same group
+        portfolio.add_basis_swap('BasisMirrored', 'USD/USD.OIS', 'USD.LIBOR.6M', 'USD.LIBOR.3M', 42000, 'E',
+                                 Tenor('10Y'), conv6m, conv3m, 5e6, -.001)
+        group_pvs = portfolio.calc_group_pvs(cm)
+        self.assertEqual(len(group_pvs), 3)
+        aae(group_pvs[('USD.LIBOR.3M', 'USD.LIBOR.6M', 'USD/USD.OIS')], pvs[2] + portfolio.calc_pvs(cm)[4])
+
 
 class PriceLadderTest(unittest.TestCase):
     def test_price_ladder(self):
@@ -300,6 +517,142 @@ class CurveInterpolationTest(unittest.TestCase):
         aae(c.get_df([1.3, 1.9]), [3.845169, 2.2995965])
         # aae(c.get_df([1.3, 1.9]), [3.8450911,  2.2995577])
 
+    def test_curve_hermite_logdf(self):
+        times, dfs = arr(0.5, 1, 2, 3, 5), arr(.99, .98, .975, .96, .94)
+        c = Curve('libor', 0, times, dfs, HERMITE_LOGDF)
+        t = np.linspace(0, 5, 23)
+        aae(c.get_df(arr(0, 0.5, 1, 2, 3, 5)), np.append(1, dfs))
+        self.assertTrue(c.has_local_interpolation())
+        self.assertRaises(BaseException, lambda: c.get_df(arr(6)))
+        c.get_df(t)
+        for i in range(len(dfs)):
+            bumped = dfs.copy()
+            bumped[i] *= 0.999
+            version = c.get_version()
+            c.set_dof(i, bumped[i])
+            self.assertNotEqual(c.get_version(), version)
+            aae(c.get_df(t), Curve('libor', 0, times, bumped, HERMITE_LOGDF).get_df(t), decimal=12)
+            c.set_dof(i, dfs[i])
+        aae(c.get_df(t), Curve('libor', 0, times, dfs, HERMITE_LOGDF).get_df(t), decimal=12)
+        # Copy shares the interpolator, updates of either curve must not be visible in the other one
+        c2 = copy.copy(c)
+        bumped = dfs.copy()
+        bumped[2] *= 0.999
+        c2.set_dof(2, bumped[2])
+        aae(c2.get_df(t), Curve('libor', 0, times, bumped, HERMITE_LOGDF).get_df(t), decimal=12)
+        aae(c.get_df(t[1:]), Curve('libor', 0, times, dfs, HERMITE_LOGDF).get_df(t[1:]), decimal=12)
+        c.set_dof(1, dfs[1] * 0.999)
+        aae(c2.get_df(t[1:]), Curve('libor', 0, times, bumped, HERMITE_LOGDF).get_df(t[1:]), decimal=12)
+        sc = ScenarioCurve('libor', 0, times, [dfs, dfs * .99], HERMITE_LOGDF)
+        aae(sc.get_df(t)[1], Curve('libor', 0, times, dfs * .99, HERMITE_LOGDF).get_df(t))
+
+    def test_scenario_curve(self):
+        times = arr(0.5, 1, 2, 3)
+        dfs = np.array([[.99, .98, .975, .96], [.995, .97, .96, .955]])
+        t = arr(0.2, 1.3, 1.9, 2.5)
+        for mode in [LINEAR_LOGDF, LINEAR_CCZR, CUBIC_LOGDF]:
+            c = ScenarioCurve('libor', 0, times, dfs, mode)
+            self.assertEqual(c.get_scenario_count(), 2)
+            self.assertEqual(c.get_df(t).shape, (2, 4))
+            for i in range(2):
+                ci = Curve('libor', 0, times, dfs[i], mode)
+                aae(c.get_df(t)[i], ci.get_df(t))
+                aae(c.get_zero_rate(t, CONTINUOUS, DCC.ACT365)[i], ci.get_zero_rate(t, CONTINUOUS, DCC.ACT365))
+                aae(c.get_fwd_rate(t[:-1], t[1:], ZEROFREQ, DCC.ACT360)[i],
+                    ci.get_fwd_rate(t[:-1], t[1:], ZEROFREQ, DCC.ACT360))
+                aae(c.get_fwd_rate_aligned(t, ZEROFREQ, DCC.ACT365)[i], ci.get_fwd_rate_aligned(t, ZEROFREQ, DCC.ACT365))
+                aae(c.get_scenario(i).get_df(t), ci.get_df(t))
+        self.assertRaises(BaseException, lambda: ScenarioCurve('libor', 0, times, dfs[0], LINEAR_LOGDF))
+
+    def test_query_cache(self):
+        c = Curve('libor', 0, arr(1, 2), arr(.98, .975), LINEAR_LOGDF)
+        t = arr(1.3, 1.9)
+        df1 = c.get_df(t)
+        self.assertTrue(df1.flags.writeable)
+        df2 = c.get_df(t.copy())
+        self.assertTrue(df2.flags.writeable)
+        self.assertEqual(c.get_cache_stats()['hits'], 1)
+        df1 *= 2  # Callers can modify returned arrays without affecting the cache
+        df2 *= 2
+        aae(c.get_df(t), df1 / 2)
+        aae(c.get_fwd_rate_aligned(t, ZEROFREQ, DCC.ACT365), c.get_fwd_rate_aligned(t, ZEROFREQ, DCC.ACT365))
+        self.assertFalse(np.array_equal(c.get_zero_rate(t, ZEROFREQ, DCC.ACT365),
+                                        c.get_zero_rate(t, CONTINUOUS, DCC.ACT365)))
+        version = c.get_version()
+        c.set_all_dofs(arr(.97, .96))
+        self.assertNotEqual(c.get_version(), version)
+        aae(c.get_df(t), Curve('libor', 0, arr(1, 2), arr(.97, .96), LINEAR_LOGDF).get_df(t))
+        cb = c.create_bumped(arr(.01, 0))
+        self.assertNotEqual(cb.get_version(), c.get_version())
+        aae(cb.get_df(arr(1.)), [.98])
+        c.set_cache_size(0)
+        self.assertIsNot(c.get_df(t), c.get_df(t))
+        c2 = copy.copy(c)
+        self.assertNotEqual(c2.get_version(), c.get_version())
+        c2.set_dof(0, .5)
+        aae(c.get_all_dofs(), arr(.97, .96))
+        aae(c.get_df(t), Curve('libor', 0, arr(1, 2), arr(.97, .96), LINEAR_LOGDF).get_df(t))
+        aae(c2.get_df(t), Curve('libor', 0, arr(1, 2), arr(.5, .96), LINEAR_LOGDF).get_df(t))
+        c.set_cache_size(32)
+        c.set_cache_enabled(False)
+        c.get_df(t)
+        c.get_df(t)
+        self.assertEqual(c.get_cache_stats()['misses'], 0)
+        self.assertTrue(c.get_df(t).flags.writeable)
+
+    def test_spread_curve(self):
+        base = Curve('USD.LIBOR.3M', 0, arr(1, 2, 3), arr(.98, .97, .95), LINEAR_LOGDF)
+        spread = Curve('USD.LIBOR.6M', 0, arr(1, 2, 3), arr(.999, .998, .996), LINEAR_LOGDF)
+        c = SpreadCurve.FromCurves('USD.LIBOR.6M', base, spread)
+        t = arr(0.5, 1.5, 2.5)
+        expected = copy.copy(spread)
+        expected.add_another_curve(base)
+        aae(c.get_df(t), expected.get_df(t))
+        self.assertEqual(c.get_dofs_count(), 3)
+        version = c.get_version()
+        base.set_all_dofs(arr(.97, .96, .94))
+        self.assertNotEqual(c.get_version(), version)
+        aae(c.get_df(t), base.get_df(t) * spread.get_df(t))
+        c2 = SpreadCurve('USD.LIBOR.6M', base, 0, arr(1.5, 3), arr(.999, .997), LINEAR_CCZR)
+        aae(c2.get_df(arr(1.5, 3)), base.get_df(arr(1.5, 3)) * arr(.999, .997))
+        self.assertRaises(BaseException, lambda: SpreadCurve('USD.LIBOR.6M', base, 1, arr(2), arr(.99), LINEAR_LOGDF))
+
+        # Bump of the base curve reaches the spread curve in a bumped curvemap
+        cm = CurveMap()
+        cm.add_curve(base)
+        cm.add_curve(c)
+        bumped = BumpedCurveMap(cm)
+        bumped.set_all_dofs_deltas(['USD.LIBOR.3M'], arr(-.01, 0, 0))
+        self.assertIs(bumped['USD.LIBOR.6M'].get_base(), bumped['USD.LIBOR.3M'])
+        aae(bumped['USD.LIBOR.6M'].get_df(t), bumped['USD.LIBOR.3M'].get_df(t) * spread.get_df(t))
+        aae(c.get_df(t), base.get_df(t) * spread.get_df(t))
+        bumped.set_all_dofs_deltas(['USD.LIBOR.3M'], arr(0, 0, 0))
+        self.assertIs(bumped['USD.LIBOR.6M'], c)
+        cm.freeze()
+        self.assertTrue(base.is_frozen())
+
+    def test_materialized_curve(self):
+        times, dfs = 42000 + arr(1, 30, 365, 3650), arr(.999, .99, .97, .75)
+        t = 42000 + np.arange(0, 3651, 7)
+        for mode in [LINEAR_LOGDF, LINEAR_CCZR, CUBIC_LOGDF]:
+            c = Curve('libor', 42000, times, dfs, mode)
+            m = Curve('libor', 42000, times, dfs, mode)
+            m.set_materialized()
+            self.assertTrue(m.is_materialized())
+            aae(m.get_df(t), c.get_df(t))
+            aae(m.get_df(t.astype(np.int64)), c.get_df(t))
+            self.assertEqual(len(m.get_dense_dfs()), 3651)
+            aae(m.get_df(arr(42000.5, 42100.25)), c.get_df(arr(42000.5, 42100.25)))
+            self.assertRaises(BaseException, lambda: m.get_df(arr(43000, 47000)))
+            m.set_all_dofs(dfs * .99)
+            c.set_all_dofs(dfs * .99)
+            aae(m.get_df(t), c.get_df(t))
+            mb = m.create_bumped(arr(.001, 0, 0, 0))
+            self.assertFalse(mb.is_materialized())
+            aae(mb.get_df(t), c.create_bumped(arr(.001, 0, 0, 0)).get_df(t))
+            self.assertIsNone(mb.dense_dfs_)
+            self.assertTrue(m.is_materialized())
+
 
 class CurveMapTests(unittest.TestCase):
     def test_plot(self):
@@ -316,6 +669,139 @@ class CurveMapTests(unittest.TestCase):
         # cm.plot(".*", mode=PlottingMode.ZERO_RATE)
         # cm.plot(".*", mode=PlottingMode.FWD_RATE)
 
+    def test_dofs_buffer(self):
+        c1 = Curve('USD.LIBOR.3M', 42000 + 0, 42000 + arr(0.001, 1, 2), arr(.99, .98, .975), CUBIC_LOGDF)
+        c2 = Curve('USD.LIBOR.6M', 42000 + 0, 42000 + arr(0.002, 3, 4), arr(.99, .98, .975), LINEAR_LOGDF)
+        cm = CurveMap()
+        cm.add_curve(c1)
+        cm.add_curve(c2)
+        dfs1 = c1.dfs_
+        aae(cm.get_all_dofs(cm.keys()), [.99, .98, .975, .99, .98, .975])
+        self.assertIs(c1.dfs_, dfs1)  # Reading does not bind curves to a buffer
+        cm.set_all_dofs(cm.keys(), arr(.99, .98, .975, .99, .98, .975))
+        dfs1, dfs2 = c1.dfs_, c2.dfs_
+        self.assertTrue(np.shares_memory(dfs1, dfs2.base))
+        cm.set_all_dofs(cm.keys(), arr(.9, .8, .7, .6, .5, .4))
+        self.assertIs(c1.dfs_, dfs1)
+        self.assertIs(c2.dfs_, dfs2)
+        aae(c1.dfs_, [1, .9, .8, .7])
+        self.assertRaises(AssertionError, lambda: cm.set_all_dofs(cm.keys(), arr(1., 2., 3.)))
+        aae(cm.get_all_dofs(cm.keys()), [.9, .8, .7, .6, .5, .4])
+        aae(c2.get_df(42000 + arr(0, 3, 4)), [1, .5, .4])
+        cm.set_all_dofs({'USD.LIBOR.6M'}, arr(.95, .94, .93))
+        aae(cm.get_all_dofs(cm.keys()), [.9, .8, .7, .95, .94, .93])
+        c3 = Curve('USD.LIBOR.6M', 42000 + 0, 42000 + arr(0.002, 3, 4), arr(.99, .98, .975), LINEAR_LOGDF)
+        cm.add_curve(c3)
+        aae(cm.get_all_dofs(cm.keys()), [.9, .8, .7, .99, .98, .975])
+
+    def test_frozen_snapshot(self):
+        c1 = Curve('USD.LIBOR.3M', 42000, 42000 + arr(1, 2, 3), arr(.99, .98, .975), CUBIC_LOGDF)
+        c2 = Curve('USD.LIBOR.6M', 42000, 42000 + arr(3, 4), arr(.98, .975), HERMITE_LOGDF)
+        cm = CurveMap()
+        cm.add_curve(c1)
+        cm.add_curve(c2)
+        cm.set_all_dofs(cm.keys(), arr(.99, .98, .97, .96, .95))
+        publisher = CurveMapPublisher()
+        self.assertIsNone(publisher.publish(cm))
+        self.assertTrue(cm.is_frozen())
+        self.assertIs(publisher.get_snapshot(), cm)
+        self.assertRaises(BaseException, lambda: cm.set_all_dofs(cm.keys(), arr(.9, .9, .9, .9, .9)))
+        self.assertRaises(BaseException, lambda: cm.set_dof(cm.keys(), 0, .9))
+        self.assertRaises(BaseException, lambda: c2.set_dof(0, .9))
+        self.assertRaises(BaseException, lambda: cm.add_curve(c1))
+        self.assertRaises(BaseException, lambda: cm.set_materialized())
+        self.assertRaises(BaseException, lambda: c1.set_materialized())
+        self.assertRaises(ValueError, lambda: c1.dfs_.__setitem__(1, .9))
+        aae(cm.get_all_dofs(cm.keys()), [.99, .98, .97, .96, .95])
+        aae(c1.get_df(42000 + arr(1, 2, 3)), [.99, .98, .97])
+        bumped = BumpedCurveMap(cm)
+        bumped.set_all_dofs_deltas(cm.keys(), arr(0, 0, 0, 0, -.01))
+        aae(bumped['USD.LIBOR.6M'].get_df(42000 + arr(4)), [.94])
+        self.assertFalse(bumped['USD.LIBOR.6M'].is_frozen())
+        cm2 = CurveMap()
+        cm2.add_curve(c1.create_bumped(arr(0, 0, 0)))
+        self.assertIs(publisher.publish(cm2), cm)
+        self.assertGreater(cm2.get_snapshot_id(), cm.get_snapshot_id())
+
+    def test_pickle_and_copy(self):
+        import pickle
+        t = 42000 + np.arange(1, 1001) * 10
+        c1 = Curve('USD.LIBOR.3M', 42000, t, np.exp(-0.02 * (t - 42000) / 365), CUBIC_LOGDF)
+        c2 = Curve('USD.LIBOR.6M', 42000, t, np.exp(-0.025 * (t - 42000) / 365), LINEAR_LOGDF)
+        cm = CurveMap()
+        cm.add_curve(c1)
+        cm.add_curve(c2)
+        cm.set_all_dofs(cm.keys(), cm.get_all_dofs(cm.keys()))
+        t_query = 42000 + arr(5, 500, 5000)
+        dfs = c1.get_df(t_query)
+        payload = pickle.dumps(c1)
+        self.assertLess(len(payload), c1.times_.nbytes + c1.dfs_.nbytes + 1000)
+        c1_copy = pickle.loads(payload)
+        aae(c1_copy.get_df(t_query), dfs)
+        self.assertNotEqual(c1_copy.get_version(), c1.get_version())
+        cm_copy = pickle.loads(pickle.dumps(cm))
+        aae(cm_copy.get_all_dofs(cm_copy.keys()), cm.get_all_dofs(cm.keys()))
+        cm_deepcopy = copy.deepcopy(cm)
+        cm_deepcopy.set_all_dofs(cm.keys(), cm.get_all_dofs(cm.keys()) * .99)
+        aae(cm['USD.LIBOR.3M'].get_df(t_query), dfs)
+        cm_shallow = copy.copy(cm)
+        self.assertIs(cm_shallow['USD.LIBOR.3M'], c1)
+        cm.freeze()
+        cm_frozen = pickle.loads(pickle.dumps(cm))
+        self.assertEqual(cm_frozen.get_snapshot_id(), cm.get_snapshot_id())
+        self.assertTrue(cm_frozen['USD.LIBOR.6M'].is_frozen())
+        bumped = BumpedCurveMap(cm)
+        bumped.set_all_dofs_deltas(cm.keys(), np.append(np.zeros(1999), -.01))
+        bumped_dfs = bumped['USD.LIBOR.6M'].get_df(t_query)
+        aae(pickle.loads(pickle.dumps(bumped))['USD.LIBOR.6M'].get_df(t_query), bumped_dfs)
+
+    def test_query(self):
+        cm = CurveMap()
+        cm.add_curve(Curve('USD.LIBOR.3M', 42000, 42000 + arr(90, 365, 730), arr(.99, .98, .975), CUBIC_LOGDF))
+        cm.add_curve(Curve('USD.LIBOR.6M', 42000, 42000 + arr(90, 365, 730), arr(.985, .97, .96), CUBIC_LOGDF))
+        cm.add_curve(Curve('USD.OIS', 42000, 42000 + arr(30, 365, 730), arr(.995, .985, .98), LINEAR_LOGDF))
+        t1 = 42000 + arr(10, 100, 200, 300)
+        t2 = 42000 + arr(50, 100, 700)
+        queries = [CurveQuery('USD.LIBOR.3M', t1),
+                   CurveQuery('USD.LIBOR.6M', t2, CurveQuantity.ZR, CONTINUOUS),
+                   CurveQuery('USD.OIS', t1, CurveQuantity.FWD, ZEROFREQ, DCC.ACT365),
+                   CurveQuery('USD.LIBOR.3M', t2, CurveQuantity.FWD)]
+        results = cm.query(queries)
+        aae(results[0], cm['USD.LIBOR.3M'].get_df(t1))
+        aae(results[1], cm['USD.LIBOR.6M'].get_zero_rate(t2, CONTINUOUS, DCC.ACT360))
+        aae(results[2], cm['USD.OIS'].get_fwd_rate_aligned(t1, ZEROFREQ, DCC.ACT365))
+        aae(results[3], cm['USD.LIBOR.3M'].get_fwd_rate_aligned(t2, ZEROFREQ, DCC.ACT360))
+        report = cm.get_report(t1, CurveQuantity.FWD, curve_ids=['USD.LIBOR.3M', 'USD.LIBOR.6M'])
+        self.assertEqual(list(report.keys()), ['USD.LIBOR.3M', 'USD.LIBOR.6M'])
+        aae(report['USD.LIBOR.6M'], cm['USD.LIBOR.6M'].get_fwd_rate_aligned(t1, ZEROFREQ, DCC.ACT360))
+
+    def test_bumped_curvemap(self):
+        c1 = Curve('USD.LIBOR.3M', 42000 + 0, 42000 + arr(0.001, 1, 2), arr(.99, .98, .975), CUBIC_LOGDF)
+        c2 = Curve('USD.LIBOR.6M', 42000 + 0, 42000 + arr(0.002, 3, 4), arr(.99, .98, .975), LINEAR_LOGDF)
+        cm = CurveMap()
+        cm.add_curve(c1)
+        cm.add_curve(c2)
+        bumped = BumpedCurveMap(cm)
+        bumped.set_all_dofs_deltas(cm.keys(), arr(0, 0, 0, 0, -.01, 0))
+        self.assertEqual(len(bumped), 2)
+        self.assertEqual(bumped.get_bumped_curve_names(), ['USD.LIBOR.6M'])
+        self.assertIs(bumped['USD.LIBOR.3M'], c1)
+        self.assertIsNot(bumped['USD.LIBOR.6M'], c2)
+        self.assertIs(bumped['USD.LIBOR.6M'].times_, c2.times_)
+        aae(bumped['USD.LIBOR.6M'].get_all_dofs(), [.99, .97, .975])
+        aae(c2.get_all_dofs(), [.99, .98, .975])
+        aae(bumped.get_all_dofs(cm.keys()), [.99, .98, .975, .99, .97, .975])
+        self.assertIsInstance(bumped.get_all_dofs(cm.keys()), np.ndarray)
+        bumped.set_dof(cm.keys(), 0, .985)
+        aae(bumped['USD.LIBOR.3M'].get_all_dofs(), [.985, .98, .975])
+        aae(c1.get_all_dofs(), [.99, .98, .975])
+        bumped.set_dof(cm.keys(), 0, .99)
+        bumped.set_all_dofs(cm.keys(), cm.get_all_dofs(cm.keys()))
+        self.assertEqual(bumped.get_bumped_curve_names(), [])
+        self.assertIs(bumped['USD.LIBOR.6M'], c2)
+        self.assertRaises(AssertionError, lambda: bumped.set_all_dofs_deltas(cm.keys(), np.zeros(5)))
+        self.assertRaises(AssertionError, lambda: bumped.set_all_dofs_deltas(['USD.LIBOR.3M'], np.zeros(6)))
+
 
 class CurveConstructorTests(unittest.TestCase):
     def test_curve_construction(self):
@@ -337,6 +823,25 @@ class CurveConstructorTests(unittest.TestCase):
         self.assertEqual(curve.dfs_[0], 1)
         self.assertEqual(curve.dfs_[-1], 0.15920680884835336)
 
+    def test_short_rate_model_scenarios(self):
+        times = [i for i in range(2, 2 + 30 * 365 + 1, 30)]
+        args = dict(r0=.022, speed=0.01, mean=.05, sigma=0.005, interpolation=LINEAR_LOGDF, scenarios=50, seed=1)
+        curve = CurveConstructor.FromShortRateModelScenarios('USD.OIS', times, chunk_size=20, **args)
+        self.assertIsInstance(curve, ScenarioCurve)
+        self.assertEqual(curve.get_scenario_count(), 50)
+        self.assertEqual(curve.dfs_.shape, (50, len(times)))
+        self.assertTrue(np.all(curve.dfs_[:, 0] == 1.))
+        self.assertEqual(len(set(curve.dfs_[:, -1])), 50)
+        dofs = CurveConstructor.FromShortRateModelScenarios('USD.OIS', times, chunk_size=20, processes=2,
+                                                            return_dofs=True, **args)
+        numpy.testing.assert_array_equal(dofs, curve.get_all_dofs())
+        # Zero volatility gives deterministic mean-reverting rates
+        args.update(sigma=0.)
+        dofs = CurveConstructor.FromShortRateModelScenarios('USD.OIS', times, return_dofs=True, **args)
+        aae(dofs[0], dofs[-1])
+        self.assertGreater(dofs[0][-1], np.exp(-.05 * 30))
+        self.assertLess(dofs[0][-1], np.exp(-.022 * 30))
+
     def add_two_curves(self):
         random.seed(1)
         times = [i for i in range(2, 2 + 80 * 365 + 1, 10)]
@@ -420,6 +925,110 @@ class BuilderCompositeTests(unittest.TestCase):
             self.assertLess(error, bumpdiff / 100.)
 
 
+class RiskCalculatorTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        eval_date = 42000
+        cls.curve_builder = CurveBuilder('engine_test.xlsx', eval_date)
+        pricing_curvemap = CurveMap()
+        constructor = CurveConstructor.FromShortRateModel
+        interp = InterpolationMode.LINEAR_LOGDF
+        t = [i for i in range(eval_date + 0, eval_date + 80 * 365 + 1, 10)]
+        random.seed(1)
+        pricing_curvemap.add_curve(constructor('USD.LIBOR.3M', t, r0=.022, speed=0.0001, mean=.05, sigma=0.0005,
+                                               interpolation=interp))
+        random.seed(2)
+        pricing_curvemap.add_curve(constructor('USD.LIBOR.6M', t, r0=.022, speed=0.0001, mean=.05, sigma=0.0005,
+                                               interpolation=interp))
+        random.seed(2)
+        pricing_curvemap.add_curve(constructor('USD/USD.OIS', t, r0=.02, speed=0.0001, mean=-.05, sigma=0.0005,
+                                               interpolation=interp))
+        target_prices = cls.curve_builder.reprice(pricing_curvemap)
+        cls.build_output = cls.curve_builder.build_curves(target_prices)
+
+    def test_publish_snapshot(self):
+        publisher = CurveMapPublisher()
+        base_curvemap = self.build_output.output_curvemap
+        build_output = self.curve_builder.build_curves(self.build_output.input_prices, solved_curvemap=base_curvemap,
+                                                       first_stage=1, publisher=publisher)
+        snapshot = publisher.get_snapshot()
+        self.assertIs(snapshot, build_output.output_curvemap)
+        self.assertTrue(snapshot.is_frozen())
+        self.assertFalse(base_curvemap.is_frozen())
+        aae(snapshot.get_all_dofs(snapshot.keys()), base_curvemap.get_all_dofs(base_curvemap.keys()))
+
+    def test_disk_cache(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as cache_dir:
+            instruments = ['USD.LIBOR.3M__Swap__10Y']
+            risk_engine = RiskCalculator(self.curve_builder, self.build_output, cache_dir=cache_dir)
+            curvemap1 = risk_engine.get_bumped_curvemap(instruments, 1e-4, BumpType.JACOBIAN_REBUILD)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            risk_engine2 = RiskCalculator(self.curve_builder, self.build_output, cache_dir=cache_dir)
+            curvemap2 = risk_engine2.get_bumped_curvemap(instruments, 1e-4, BumpType.JACOBIAN_REBUILD)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            aae(curvemap1.get_all_dofs(curvemap1.keys()), curvemap2.get_all_dofs(curvemap2.keys()))
+
+            risk_engine2.get_bumped_curvemap(instruments, 2e-4, BumpType.JACOBIAN_REBUILD)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            # Cache directory which can not be created (its parent is a file) does not stop the calculation
+            blocked_dir = join(cache_dir, os.listdir(cache_dir)[0], 'cache')
+            risk_engine3 = RiskCalculator(self.curve_builder, self.build_output, cache_dir=blocked_dir)
+            curvemap3 = risk_engine3.get_bumped_curvemap(instruments, 1e-4, BumpType.JACOBIAN_REBUILD)
+            aae(curvemap1.get_all_dofs(curvemap1.keys()), curvemap3.get_all_dofs(curvemap3.keys()))
+
+    def test_portfolio_delta(self):
+        risk_engine = RiskCalculator(self.curve_builder, self.build_output)
+        names = risk_engine.get_instrument_names()
+        swap = self.curve_builder.get_instrument_by_name('USD.LIBOR.3M__Swap__10Y')
+        deposit = self.curve_builder.get_instrument_by_name('USD.LIBOR.3M__Deposit__3M')
+        pricer = lambda curvemap: np.array([swap.calc_par_rate(curvemap), deposit.calc_par_rate(curvemap)])
+        gradient = risk_engine.calc_portfolio_gradient(pricer)
+        self.assertEqual(gradient.shape, (len(names), 2))
+        deltas = risk_engine.get_portfolio_delta(gradient)
+        self.assertEqual(deltas.shape, (len(names), 2))
+        # Par rate of a calibration instrument has unit delta to itself and zero delta to all other instruments
+        expected = np.zeros((len(names), 2))
+        expected[names.index(swap.get_name()), 0] = 1.
+        expected[names.index(deposit.get_name()), 1] = 1.
+        aae(deltas, expected, decimal=3)
+        aae(risk_engine.get_portfolio_delta(gradient[:, 0]), deltas[:, 0])
+
+    def test_portfolio_gamma(self):
+        risk_engine = RiskCalculator(self.curve_builder, self.build_output)
+        s1, s2 = 'USD.LIBOR.6M__BasisSwap__10Y', 'USD.LIBOR.6M__BasisSwap__20Y'
+        i1 = self.curve_builder.get_instrument_by_name(s1)
+        i2 = self.curve_builder.get_instrument_by_name(s2)
+        pricer = lambda curvemap: i1.calc_par_rate(curvemap) ** 2 + i1.calc_par_rate(curvemap) * i2.calc_par_rate(curvemap)
+        gamma = risk_engine.get_portfolio_gamma(pricer, [s1, s2])
+        aae(gamma, [[2., 1.], [1., 0.]], decimal=2)
+        gamma_sparse = risk_engine.get_portfolio_gamma(pricer, [s1, s2], sparse=True, threshold=0.1)
+        self.assertEqual(gamma_sparse.nnz, 3)
+        aae(gamma_sparse.toarray(), gamma * (abs(gamma) > 0.1))
+
+    def test_scenario_engine(self):
+        risk_engine = RiskCalculator(self.curve_builder, self.build_output)
+        names = risk_engine.get_instrument_names()
+        name = 'USD.LIBOR.6M__BasisSwap__10Y'
+        instrument = self.curve_builder.get_instrument_by_name(name)
+        shifts = np.zeros((5, len(names)))
+        shifts[:, names.index(name)] = arr(-2e-4, -1e-4, 0, 1e-4, 2e-4)
+        shifts[:, names.index('USD.LIBOR.6M__BasisSwap__20Y')] = 1e-4
+        engine = ScenarioEngine(risk_engine, chunk_size=2)
+        self.assertEqual(sum(1 for _ in engine.iter_curvemaps(shifts)), 5)
+        pnl = engine.calc_scenario_pnl(instrument.calc_par_rate, shifts)
+        aae(pnl, arr(-2e-4, -1e-4, 0, 1e-4, 2e-4), decimal=6)
+        aae(engine.calc_scenario_values(instrument.calc_par_rate, shifts),
+            [instrument.calc_par_rate(curvemap) for curvemap in engine.iter_curvemaps(shifts)], decimal=12)
+        aae(ScenarioEngine.calc_var(pnl, 0.75), 1e-4, decimal=6)
+        indices, errors = engine.validate(shifts, sample_size=1, seed=1)
+        self.assertEqual(len(indices), 1)
+        self.assertLess(errors[0], 1e-5)
+        self.assertRaises(BaseException, lambda: list(engine.iter_dofs_responses(shifts[:, 1:])))
+
+
 if __name__ == '__main__':
     if is_running_under_teamcity():
         runner = TeamcityTestRunner()
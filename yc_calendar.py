@@ -1,43 +1,142 @@
 # Copyright © 2017 Ondrej Martinsky, All rights reserved
 # http://github.com/omartinsky/pybor
-from typing import Dict, List, Set
+import hashlib
+import os
+import re
+from typing import Dict, List, Optional, Set
 
 from yc_date import *
+from yc_helpers import NpyDiskCache
 
+# Business day lookups are supported for dates in this range (excel dates, end exclusive)
+calendar_range = (61, pydate_to_exceldate(datetime.date(2300, 1, 1)))
 
-def is_weekend(date):
-    date = exceldate_to_pydate(date)
-    dow = date.weekday()
-    # 0,1,2,3,4 is Monday to Friday
-    # 5,6 is Saturday, Sunday
-    return dow >= 5
+
+def is_weekend(date) -> bool:
+    # Excel date 2 (1900-01-01) was Monday, (date + 5) % 7 is 0 for Monday to 6 for Sunday
+    return (date + 5) % 7 >= 5
+
+
+def is_weekend_array(dates) -> np.ndarray:
+    # Excel date 2 (1900-01-01) was Monday, (date + 5) % 7 is 0 for Monday to 6 for Sunday
+    return (np.asarray(dates) + 5) % 7 >= 5
+
+
+def check_calendar_range(dates):
+    dates = np.asarray(dates)
+    assert np.all(dates >= calendar_range[0]) and np.all(dates < calendar_range[1]), \
+        "Dates are outside of supported calendar range [%i..%i)" % calendar_range
 
 
 class CalendarBase:
-    def __init__(self):
-        pass
+    """
+    Holidays are stored as a boolean mask over the whole calendar range, which is built on first use together
+    with the business day index, so holidays must not be changed afterwards.
+    """
 
-    def is_holiday(self, date: int):
-        assert False, 'method must be implemented in child class %s' % type(self)
+    def __init__(self):
+        self.holiday_mask_ = None
+        self.business_day_index_ = None
+
+    def calc_holiday_mask(self) -> np.ndarray:
+        # Fallback for child classes which define holidays by overriding is_holiday for a single date
+        assert type(self).is_holiday is not CalendarBase.is_holiday, \
+            'calc_holiday_mask or is_holiday must be implemented in child class %s' % type(self)
+        return np.fromiter((self.is_holiday(date) for date in range(*calendar_range)), dtype=bool,
+                           count=calendar_range[1] - calendar_range[0])
+
+    def get_holiday_mask(self) -> np.ndarray:
+        # Element i is True when date calendar_range[0] + i is a holiday
+        if self.holiday_mask_ is None:
+            mask = np.asarray(self.calc_holiday_mask(), dtype=bool)
+            assert mask.shape == (calendar_range[1] - calendar_range[0],)
+            mask.flags.writeable = False
+            self.holiday_mask_ = mask
+        return self.holiday_mask_
+
+    def is_holiday(self, dates):
+        # Works with a single date and with arrays of dates
+        check_calendar_range(dates)
+        out = self.get_holiday_mask()[np.asarray(dates, dtype=np.int64) - calendar_range[0]]
+        return bool(out) if out.ndim == 0 else out
+
+    def get_business_day_index(self):
+        # Returns (counts, business_days). Element i of counts is the number of business days before date
+        # calendar_range[0] + i, business_days are all business days of the calendar range in ascending order.
+        if self.business_day_index_ is None:
+            is_business_day = ~self.get_holiday_mask()
+            counts = np.zeros(len(is_business_day) + 1, dtype=np.int64)
+            np.cumsum(is_business_day, out=counts[1:])
+            business_days = np.flatnonzero(is_business_day) + calendar_range[0]
+            self.business_day_index_ = (counts, business_days)
+        return self.business_day_index_
+
+    def add_business_days(self, dates, n):
+        # Returns n-th business day after the date (before the date when n is negative), date itself when n is zero.
+        # Same as stepping one calendar day and rolling to the following business day n times.
+        # Works with scalars and with arrays of dates and/or offsets.
+        check_calendar_range(dates)
+        counts, business_days = self.get_business_day_index()
+        d = np.asarray(dates, dtype=np.int64) - calendar_range[0]
+        n = np.asarray(n, dtype=np.int64)
+        ix = np.where(n > 0, counts[d + 1] + n - 1, counts[d] + n)
+        assert np.all(ix >= 0) and np.all(ix < len(business_days)), "Business day is outside of calendar range"
+        out = np.where(n == 0, d + calendar_range[0], business_days[np.clip(ix, 0, len(business_days) - 1)])
+        return int(out) if out.ndim == 0 else out
+
+    def get_following_business_days(self, dates):
+        # First business day on or after each date
+        check_calendar_range(dates)
+        counts, business_days = self.get_business_day_index()
+        ix = counts[np.asarray(dates, dtype=np.int64) - calendar_range[0]]
+        assert np.all(ix < len(business_days)), "Business day is outside of calendar range"
+        return business_days[ix]
+
+    def get_preceding_business_days(self, dates):
+        # Last business day on or before each date
+        check_calendar_range(dates)
+        counts, business_days = self.get_business_day_index()
+        ix = counts[np.asarray(dates, dtype=np.int64) - calendar_range[0] + 1] - 1
+        assert np.all(ix >= 0), "Business day is outside of calendar range"
+        return business_days[ix]
+
+    def is_business_day(self, dates):
+        check_calendar_range(dates)
+        counts, business_days = self.get_business_day_index()
+        d = np.asarray(dates, dtype=np.int64) - calendar_range[0]
+        out = counts[d + 1] != counts[d]
+        return bool(out) if out.ndim == 0 else out
+
+    def count_business_days(self, dates_from, dates_to):
+        # Number of business days in [date_from, date_to), negative when date_to is before date_from
+        check_calendar_range(dates_from)
+        check_calendar_range(dates_to)
+        counts, business_days = self.get_business_day_index()
+        out = counts[np.asarray(dates_to) - calendar_range[0]] - counts[np.asarray(dates_from) - calendar_range[0]]
+        return int(out) if out.ndim == 0 else out
 
 
 class WeekendCalendar(CalendarBase):
     def __init__(self):
         super().__init__()
 
-    def is_holiday(self, date: int) -> bool:
-        return is_weekend(date)
+    def calc_holiday_mask(self) -> np.ndarray:
+        return is_weekend_array(np.arange(*calendar_range))
 
 
 class EnumeratedCalendar(CalendarBase):
-    def __init__(self, holidays: Set[int]):
+    def __init__(self, holidays: Set[int], holiday_mask: Optional[np.ndarray] = None):
+        # Holiday mask, when given, must already contain weekends and all the holidays
+        super().__init__()
         self.holidays_ = holidays
+        self.holiday_mask_ = holiday_mask
 
     def get_holidays(self) -> Set[int]:
         return self.holidays_
 
-    def is_holiday(self, date: int) -> bool:
-        return is_weekend(date) or date in self.holidays_
+    def calc_holiday_mask(self) -> np.ndarray:
+        dates = np.arange(*calendar_range)
+        return is_weekend_array(dates) | np.isin(dates, np.fromiter(self.holidays_, dtype=np.int64))
 
 
 def union_calendars(calendars: List[CalendarBase]) -> CalendarBase:
@@ -45,28 +144,97 @@ def union_calendars(calendars: List[CalendarBase]) -> CalendarBase:
     if len(calendars) == 1:
         return calendars[0]
     holidays = set()
+    mask = np.zeros(calendar_range[1] - calendar_range[0], dtype=bool)
     for cal in calendars:
-        holidays = holidays | cal.get_holidays()
-    return EnumeratedCalendar(holidays)
+        if isinstance(cal, EnumeratedCalendar):
+            holidays = holidays | cal.get_holidays()
+        mask |= cal.get_holiday_mask()
+    mask.flags.writeable = False
+    return EnumeratedCalendar(holidays, mask)
+
+
+def read_holiday_file(path: str) -> np.ndarray:
+    # Returns excel dates of holidays listed in the file. Supported formats are
+    #   .csv - one ISO date (YYYY-MM-DD) per line, first column is used, other lines (headers, comments) are skipped
+    #   .ics - iCalendar file, DTSTART of every event is a holiday
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    if path.endswith('.ics'):
+        dates = ['%s-%s-%s' % m for m in re.findall(r'^DTSTART[^:]*:(\d{4})(\d{2})(\d{2})', text, re.MULTILINE)]
+    elif path.endswith('.csv'):
+        dates = [m.group(1) for m in (re.match(r'\s*(\d{4}-\d{2}-\d{2})', line) for line in text.splitlines()) if m]
+    else:
+        raise BaseException("Unsupported holiday file %s" % path)
+    return datetime64_to_exceldates(np.array(dates, dtype='datetime64[D]'))
+
+
+class CalendarDiskCache(NpyDiskCache):
+    """
+    Compiled holiday masks (raw bool .npy files) keyed by hash of the holiday file, so that a calendar is parsed
+    only once while its source file is unchanged. Files are memory-mapped when read and written atomically.
+    """
+
+    @staticmethod
+    def create_key(path: str) -> str:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            h.update(f.read())
+        h.update(("%s;%r" % (os.path.basename(path), calendar_range)).encode())
+        return h.hexdigest()
+
+    def store(self, key: str, mask):
+        # Calendars still load when the directory is not writable
+        super(CalendarDiskCache, self).store(key, np.asarray(mask, dtype=bool))
+
+
+def load_calendar(path: str, disk_cache: Optional[CalendarDiskCache] = None) -> EnumeratedCalendar:
+    key = None
+    mask = None
+    if disk_cache is not None:
+        key = CalendarDiskCache.create_key(path)
+        mask = disk_cache.load(key)
+    if mask is None:
+        mask = EnumeratedCalendar(set(int(d) for d in read_holiday_file(path))).get_holiday_mask()
+        if disk_cache is not None:
+            disk_cache.store(key, mask)
+    holidays = np.flatnonzero(mask & ~is_weekend_array(np.arange(*calendar_range))) + calendar_range[0]
+    return EnumeratedCalendar(set(int(d) for d in holidays), mask)
 
 
 class Calendars:
-    def __init__(self):
-        # TODO Complete the calendars below
-        self.dictionary: Dict[str, CalendarBase] = {
-            'London': EnumeratedCalendar(set()),
-            'NewYork': EnumeratedCalendar(set()),
-        }
+    """
+    Calendars are loaded from holiday files <data_dir>/<name>.csv or <data_dir>/<name>.ics the first time
+    they are requested. Joint calendars (e.g. London+NewYork) are created on first request and kept under their name.
+    Compiled holiday masks are cached on disk only when cache_dir is given.
+    """
+
+    def __init__(self, data_dir: Optional[str] = None, cache_dir: Optional[str] = None):
+        self.data_dir = os.path.join(os.path.dirname(__file__), 'calendars') if data_dir is None else data_dir
+        self.disk_cache = None if cache_dir is None else CalendarDiskCache(cache_dir)
+        self.dictionary: Dict[str, CalendarBase] = dict()
+
+    def find_holiday_file(self, calendar_name: str) -> Optional[str]:
+        for extension in ['.csv', '.ics']:
+            path = os.path.join(self.data_dir, calendar_name + extension)
+            if os.path.exists(path):
+                return path
+        return None
 
     def get(self, calendar_name: str) -> CalendarBase:
+        if calendar_name in self.dictionary:
+            return self.dictionary[calendar_name]
         names = calendar_name.split("+")
         if len(names) == 1:
-            name = names[0]
-            if name not in self.dictionary:
-                raise BaseException("Calendar with name %s not found" % name)
-            return self.dictionary[name]
+            path = self.find_holiday_file(calendar_name)
+            if path is None:
+                raise BaseException("Calendar with name %s not found" % calendar_name)
+            calendar = load_calendar(path, self.disk_cache)
         else:
-            return union_calendars([self.get(name) for name in names])
+            calendar = union_calendars([self.get(name) for name in names])
+        self.dictionary[calendar_name] = calendar
+        return calendar
 
 
+# TODO Complete the calendars, London.csv and NewYork.csv do not list any holidays yet, so only weekends are
+# non-business days. Holiday masks of global calendars are not cached on disk, no cache_dir is given.
 global_calendars = Calendars()
@@ -1,12 +1,11 @@
 # Copyright © 2017 Ondrej Martinsky, All rights reserved
 # http://github.com/omartinsky/pybor
+import csv
 from dataclasses import dataclass
 from os.path import join, dirname
 
 from yc_date import *
-from pandas import *
 import enum, os
-import pandas as pd
 
 from yc_helpers import enum_from_string, assert_type
 
@@ -51,10 +50,15 @@ class Convention:
 
 
 class Conventions:
-    def __init__(self):
+    def __init__(self, file: str = None):
+        # When file is given, conventions are read from it on first access
         self.map = dict()
+        self.file = file
 
     def get(self, convention_name):
+        if self.file is not None:
+            self.map = conventions_from_file(self.file).map
+            self.file = None
         if convention_name not in self.map:
             raise BaseException("Unable to get convention %s" % convention_name)
         return self.map[convention_name]
@@ -69,17 +73,18 @@ def conventions_from_file(file: str) -> Conventions:
     conventions = Conventions()
     conventions.map = dict()
     assert os.path.exists(file)
-    dataframe = pd.read_csv(file, delimiter='\t')
-    for index, row in dataframe.iterrows():
+    with open(file, newline='') as f:
+        rows = list(csv.DictReader(f, delimiter='\t'))
+    for row in rows:
         conv = Convention(
             reset_frequency=Tenor(row['Reset Frequency']),
             calculation_frequency=Tenor(row['Calculation Period Frequency']),
             payment_frequency=Tenor(row['Payment Frequency']),
             dcc=enum_from_string(DCC, row['Day Count Convention']),
         )
-        assert index not in conventions.map
+        assert row['Index'] not in conventions.map
         conventions.map[row['Index']] = conv
     return conventions
 
 
-global_conventions = conventions_from_file(join(dirname(__file__), 'conventions.txt'))
+global_conventions = Conventions(join(dirname(__file__), 'conventions.txt'))
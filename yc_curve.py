@@ -3,10 +3,10 @@
 from typing import Optional
 
 from yc_convention import *
-import scipy.interpolate
 import re
 import collections
-import matplotlib
+import copy
+import itertools
 import numpy as np
 
 from yc_helpers import enum_values_as_string
@@ -15,35 +15,177 @@ from yc_helpers import enum_values_as_string
 class PlottingHelper:
     @staticmethod
     def set_tenors_on_axis(axis, start_date):
+        import matplotlib.ticker
         tenors = "6M,1Y,2Y,3Y,4Y,5Y,7Y,10Y,15Y,20Y,30Y,40Y,50Y,60Y,70Y".split(",")
-        tenordates = [date_step(int(start_date), Tenor(t)) for t in tenors]
+        tenordates = date_step_tenors(int(start_date), tenors)
         axis.xaxis.set_ticks(tenordates)
         axis.xaxis.set_major_formatter(matplotlib.ticker.FuncFormatter(lambda x, pos: tenors[pos]))
 
 
+class CurveQuantity(enum.Enum):
+    DF = 0
+    ZR = 1
+    FWD = 2  # Forward rates over aligned periods given by consecutive dates
+
+
+class CurveQuery:
+    def __init__(self, curve_id, dates, quantity: CurveQuantity = CurveQuantity.DF, freq: CouponFreq = ZEROFREQ,
+                 dcc: Optional[DCC] = None):
+        self.curve_id = curve_id
+        self.dates = np.asarray(dates)
+        self.quantity = quantity
+        self.freq = freq
+        self.dcc = dcc
+
+
+def zero_rate_from_dfs(t_eval, t, dfs, freq, dcc):
+    dcf = calculate_dcf(t_eval, t, dcc)
+    if freq == ZEROFREQ:
+        return (1. / dfs - 1.) / dcf
+    if freq == CONTINUOUS:
+        return -np.log(dfs) / dcf
+
+
+def fwd_rate_from_dfs(t_start, t_end, dfs_start, dfs_end, freq, dcc):
+    dcf = calculate_dcf(t_start, t_end, dcc)
+    if freq == ZEROFREQ:
+        return (dfs_start / dfs_end - 1) / dcf
+    if freq == CONTINUOUS:
+        return np.log(dfs_start / dfs_end) / dcf
+
+
+class DofsBuffer:
+    """
+    Contiguous float64 buffer holding discount factors of all curves in one solve stage, laid out as
+    [1, dofs of curve 1, 1, dofs of curve 2, ...]. Discount factors of each curve are views into this buffer.
+    """
+
+    def __init__(self, curves):
+        sizes = [len(curve.dfs_) for curve in curves]
+        self.buffer = np.empty(sum(sizes), dtype=np.float64)
+        self.curves = curves
+        index = []
+        self.locations = []  # DOF number -> (curve, DOF number within the curve)
+        i = 0
+        for curve, size in zip(curves, sizes):
+            assert curve.dfs_.ndim == 1, "Curve %s cannot be stored in DOF buffer" % curve
+            self.buffer[i:i + size] = curve.dfs_
+            curve.dfs_ = self.buffer[i:i + size]
+            index.extend(range(i + 1, i + size))
+            self.locations.extend((curve, j) for j in range(size - 1))
+            i += size
+        self.index = np.array(index, dtype=np.intp)
+
+    def is_bound_to(self, curves):
+        if len(curves) != len(self.curves):
+            return False
+        for curve, bound_curve in zip(curves, self.curves):
+            if curve is not bound_curve or curve.dfs_.base is not self.buffer:
+                return False
+        return True
+
+    def get_dofs(self):
+        return self.buffer[self.index]
+
+    def set_dofs(self, dofs):
+        dofs = np.asarray(dofs, dtype=np.float64)
+        assert dofs.shape == self.index.shape, "Expected %i DOFs, got %s" % (len(self.index), dofs.shape)
+        self.buffer[self.index] = dofs
+        for curve in self.curves:
+            curve.set_interpolator()
+
+    def set_dof(self, i, dof):
+        curve, j = self.locations[i]
+        curve.set_dof(j, dof)
+
+
+# Snapshot ids are unique across all curvemaps, higher id means more recently frozen snapshot
+curvemap_snapshot_ids = itertools.count(1)
+
+
 class CurveMap:
     def __init__(self, *arg, **kw):
         super(CurveMap, self).__init__(*arg, **kw)
         self.curves_ = collections.OrderedDict()
+        self.dofs_buffers_ = dict()
+        self.snapshot_id_ = None
 
     def add_curve(self, c):
         assert_type(c, Curve)
+        self.check_not_frozen()
         self.curves_[c.get_id()] = c
 
+    def freeze(self):
+        # Makes this curvemap and all its curves immutable, so it can be shared between threads as a consistent
+        # snapshot. Everything which is otherwise built lazily on first query is built here.
+        if self.snapshot_id_ is None:
+            for curve in self.curves_.values():
+                curve.freeze()
+            self.snapshot_id_ = next(curvemap_snapshot_ids)
+        return self
+
+    def is_frozen(self):
+        return self.snapshot_id_ is not None
+
+    def get_snapshot_id(self):
+        return self.snapshot_id_
+
+    def check_not_frozen(self):
+        if self.is_frozen():
+            raise BaseException("Curvemap snapshot %i is frozen and cannot be modified" % self.snapshot_id_)
+
+    def __getstate__(self):
+        # DOF buffers are not serialized, curves are bound to new buffers on first use
+        state = self.__dict__.copy()
+        state['dofs_buffers_'] = dict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def __copy__(self):
+        # Copy holds the same curve objects
+        curvemap = self.__class__.__new__(self.__class__)
+        curvemap.__setstate__(self.__getstate__())
+        curvemap.curves_ = collections.OrderedDict(self.curves_)
+        return curvemap
+
+    def __deepcopy__(self, memo):
+        curvemap = self.__class__.__new__(self.__class__)
+        memo[id(self)] = curvemap
+        curvemap.__setstate__(copy.deepcopy(self.__getstate__(), memo))
+        return curvemap
+
+    def get_dofs_buffer(self, curves_for_stage):
+        # Curves are (re)bound to the buffer when used with this stage for the first time, or when they were
+        # replaced or their discount factors were reallocated since
+        key = frozenset(curves_for_stage)
+        curves = [v for k, v in self.curves_.items() if k in key]
+        dofs_buffer = self.dofs_buffers_.get(key)
+        if dofs_buffer is None or not dofs_buffer.is_bound_to(curves):
+            dofs_buffer = DofsBuffer(curves)
+            self.dofs_buffers_[key] = dofs_buffer
+        return dofs_buffer
+
     def get_all_dofs(self, curves_for_stage):
-        dofs = list()
-        for k, v in self.curves_.items():
-            if k in curves_for_stage:
-                dofs.extend(v.get_all_dofs())
-        return dofs
+        # Reading never binds curves to a DOF buffer, that is done by the setters
+        key = frozenset(curves_for_stage)
+        curves = [v for k, v in self.curves_.items() if k in key]
+        dofs_buffer = self.dofs_buffers_.get(key)
+        if dofs_buffer is not None and dofs_buffer.is_bound_to(curves):
+            return dofs_buffer.get_dofs()
+        return np.concatenate([c.get_all_dofs() for c in curves]) if curves else np.zeros(0)
 
     def set_all_dofs(self, curves_for_stage, dofs):
-        i = 0
-        for k, v in self.curves_.items():
-            if k in curves_for_stage:
-                j = i + v.get_dofs_count()
-                v.set_all_dofs(dofs[i:j])
-                i = j
+        self.check_not_frozen()
+        self.get_dofs_buffer(curves_for_stage).set_dofs(dofs)
+
+    def set_dof(self, curves_for_stage, i, dof):
+        self.check_not_frozen()
+        self.get_dofs_buffer(curves_for_stage).set_dof(i, dof)
+
+    def has_local_interpolation(self, curves_for_stage):
+        return all(self[name].has_local_interpolation() for name in curves_for_stage)
 
     def __getitem__(self, item):
         return self.curves_[item]
@@ -51,24 +193,184 @@ class CurveMap:
     def __len__(self):
         return len(self.curves_)
 
+    def query(self, queries):
+        # Evaluates many curve queries together. Plain curves which share pillar times and interpolation mode are
+        # stacked and interpolated in one pass on the union of all requested dates. Returns one array per query.
+        dfs = [None] * len(queries)
+        groups = collections.OrderedDict()
+        for i, q in enumerate(queries):
+            curve = self[q.curve_id]
+            if type(curve) is not Curve:
+                dfs[i] = curve.get_df(q.dates)
+                continue
+            key = (curve.interpolation_mode_, curve.times_.tobytes())
+            groups.setdefault(key, []).append(i)
+        for ixs in groups.values():
+            curve_ids = list(collections.OrderedDict.fromkeys(queries[i].curve_id for i in ixs))
+            curves = [self[curve_id] for curve_id in curve_ids]
+            dates = np.unique(np.concatenate([queries[i].dates.ravel() for i in ixs]))
+            c0 = curves[0]
+            stacked = ScenarioCurve(c0.get_id(), c0.times_[0], c0.times_[1:], [c.dfs_[1:] for c in curves],
+                                    c0.interpolation_mode_)
+            stacked_dfs = stacked.get_df(dates)
+            for i in ixs:
+                row = curve_ids.index(queries[i].curve_id)
+                dfs[i] = stacked_dfs[row, np.searchsorted(dates, queries[i].dates)]
+        return [self.calc_query_quantity(q, q_dfs) for q, q_dfs in zip(queries, dfs)]
+
+    def calc_query_quantity(self, q: CurveQuery, dfs):
+        if q.quantity == CurveQuantity.DF:
+            return dfs
+        dcc = global_conventions.get(q.curve_id).dcc if q.dcc is None else q.dcc
+        if q.quantity == CurveQuantity.ZR:
+            return zero_rate_from_dfs(self[q.curve_id].times_[0], q.dates, dfs, q.freq, dcc)
+        elif q.quantity == CurveQuantity.FWD:
+            return fwd_rate_from_dfs(q.dates[:-1], q.dates[1:], dfs[..., :-1], dfs[..., 1:], q.freq, dcc)
+        raise BaseException("Unknown curve quantity %s" % q.quantity)
+
+    def get_report(self, dates, quantity: CurveQuantity, freq: CouponFreq = ZEROFREQ, curve_ids=None):
+        # Same quantity over the same dates for many curves (all curves by default), returns curve id -> array
+        curve_ids = list(self.keys()) if curve_ids is None else curve_ids
+        results = self.query([CurveQuery(curve_id, dates, quantity, freq) for curve_id in curve_ids])
+        return collections.OrderedDict(zip(curve_ids, results))
+
+    def set_materialized(self, materialized=True):
+        self.check_not_frozen()
+        for name in self.keys():
+            self[name].set_materialized(materialized)
+
+    def set_cache_enabled(self, curves_for_stage, enabled):
+        for name in curves_for_stage:
+            self[name].set_cache_enabled(enabled)
+
     def keys(self):
         return self.curves_.keys()
 
     def plot(self, reg=".*", *arg, **kwargs):
-        for name, curve in sorted(self.curves_.items()):
+        for name in sorted(self.keys()):
             if re.match(reg, name):
-                curve.plot(*arg, **kwargs)
+                self[name].plot(*arg, **kwargs)
+
+
+class BumpedCurveMap(CurveMap):
+    """
+    Copy-on-write view of a base curvemap. Only DOF deltas of the changed curves are stored, all other curves and
+    pillar grids are shared with the base curvemap. Bumped curves are created lazily on first access, spread curves
+    whose base curve is bumped are rebased onto the bumped base curve.
+    """
+
+    def __init__(self, base_curvemap: CurveMap):
+        super(BumpedCurveMap, self).__init__()
+        assert_type(base_curvemap, CurveMap)
+        self.base_ = base_curvemap
+        self.dofs_deltas_ = collections.OrderedDict()
+
+    def add_curve(self, c):
+        raise BaseException("Unable to add curve %s, bumped curvemap shares its curves with base curvemap" % c)
+
+    def __getstate__(self):
+        # Bumped curves are not serialized, they are recreated from DOF deltas on first access
+        state = super(BumpedCurveMap, self).__getstate__()
+        state['curves_'] = collections.OrderedDict()
+        return state
+
+    def get_all_dofs(self, curves_for_stage):
+        dofs = list()
+        for k in self.keys():
+            if k in curves_for_stage:
+                curve_dofs = self.base_[k].get_all_dofs()
+                if k in self.dofs_deltas_:
+                    curve_dofs = curve_dofs + self.dofs_deltas_[k]
+                dofs.append(curve_dofs)
+        return np.concatenate(dofs) if dofs else np.zeros(0)
+
+    def set_all_dofs(self, curves_for_stage, dofs):
+        dofs = np.asarray(dofs)
+        base_dofs = self.base_.get_all_dofs(curves_for_stage)
+        self.set_all_dofs_deltas(curves_for_stage, dofs - base_dofs)
+
+    def set_all_dofs_deltas(self, curves_for_stage, dofs_deltas):
+        dofs_deltas = np.asarray(dofs_deltas, dtype=np.float64)
+        count = sum(self.base_[k].get_dofs_count() for k in self.keys() if k in curves_for_stage)
+        assert dofs_deltas.shape == (count,), "Expected %i DOF deltas, got %s" % (count, dofs_deltas.shape)
+        i = 0
+        for k in self.keys():
+            if k in curves_for_stage:
+                j = i + self.base_[k].get_dofs_count()
+                delta = np.array(dofs_deltas[i:j])
+                if delta.any():
+                    self.dofs_deltas_[k] = delta
+                else:
+                    self.dofs_deltas_.pop(k, None)
+                self.curves_.pop(k, None)
+                i = j
+        # Spread curves may be rebased onto any of the changed curves
+        for k in [k for k, curve in self.curves_.items() if isinstance(curve, SpreadCurve)]:
+            del self.curves_[k]
+
+    def set_dof(self, curves_for_stage, i, dof):
+        dofs = self.get_all_dofs(curves_for_stage)
+        dofs[i] = dof
+        self.set_all_dofs(curves_for_stage, dofs)
+
+    def get_bumped_curve_names(self):
+        return list(self.dofs_deltas_.keys())
+
+    def __getitem__(self, item):
+        if item in self.curves_:
+            return self.curves_[item]
+        curve = self.base_[item]
+        if item in self.dofs_deltas_:
+            curve = curve.create_bumped(self.dofs_deltas_[item])
+        if isinstance(curve, SpreadCurve):
+            # Spread curve of the base curvemap is rebased when its base curve is bumped in this curvemap
+            base_id = curve.get_base().get_id()
+            if base_id in self.base_.keys() and self.base_[base_id] is curve.get_base():
+                base_curve = self[base_id]
+                if base_curve is not curve.get_base():
+                    curve = curve.create_rebased(base_curve)
+        if curve is not self.base_[item]:
+            self.curves_[item] = curve
+        return curve
+
+    def __len__(self):
+        return len(self.base_)
+
+    def keys(self):
+        return self.base_.keys()
+
+
+class CurveMapPublisher:
+    """
+    Holds the most recently published curvemap snapshot. Publishing swaps the reference in a single assignment,
+    readers keep the snapshot returned by get_snapshot() for as long as they need it, without locks or copies.
+    """
+
+    def __init__(self):
+        self.snapshot_ = None
+
+    def publish(self, curvemap: CurveMap):
+        # Returns the previously published snapshot
+        assert_type(curvemap, CurveMap)
+        curvemap.freeze()
+        previous, self.snapshot_ = self.snapshot_, curvemap
+        return previous
+
+    def get_snapshot(self) -> Optional[CurveMap]:
+        return self.snapshot_
 
 
 class InterpolationMode(enum.Enum):
     LINEAR_LOGDF = 0
     LINEAR_CCZR = 1
     CUBIC_LOGDF = 2
+    HERMITE_LOGDF = 3
 
 
 LINEAR_LOGDF = InterpolationMode.LINEAR_LOGDF
 LINEAR_CCZR = InterpolationMode.LINEAR_CCZR
 CUBIC_LOGDF = InterpolationMode.CUBIC_LOGDF
+HERMITE_LOGDF = InterpolationMode.HERMITE_LOGDF
 
 
 class PlotMode(enum.Enum):
@@ -83,6 +385,63 @@ class PlotDate(enum.Enum):
     TENOR = 2
 
 
+class QueryCache:
+    """
+    Bounded LRU store of curve query results. Keys contain the curve version, so entries computed before
+    the curve was modified are never returned, they are just pushed out as new entries arrive.
+    """
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.enabled = True
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def is_enabled(self):
+        # Callers skip building the keys when the cache is disabled
+        return self.enabled and self.max_size > 0
+
+    @staticmethod
+    def array_key(t):
+        return t.dtype.str, t.shape, t.tobytes()
+
+    def get(self, key, calc):
+        # Readers of frozen curves may share the cache between threads. Single OrderedDict operations are atomic,
+        # entries removed by another thread in the meantime are simply ignored.
+        value = self.entries.get(key)
+        if value is not None:
+            try:
+                self.entries.move_to_end(key)
+            except KeyError:
+                pass
+            self.hits += 1
+            return value.copy()
+        self.misses += 1
+        value = calc()
+        if self.max_size > 0 and isinstance(value, np.ndarray):
+            # Callers always get their own writable array, the cache keeps a read-only copy
+            cached = value.copy()
+            cached.setflags(write=False)
+            self.entries[key] = cached
+            while len(self.entries) > self.max_size:
+                try:
+                    self.entries.popitem(last=False)
+                except KeyError:
+                    break
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self.entries), max_size=self.max_size)
+
+
+# Versions are unique across all curves, so a copied curve can never be confused with its origin
+curve_versions = itertools.count(1)
+
+
 class ExponentialInterpolator:
     def __init__(self, interp):
         self.interp = interp
@@ -100,6 +459,70 @@ class ZeroRateInterpolator:
         return np.exp(self.interp(t) * (t - self.t_eval))
 
 
+class LocalHermiteInterpolator:
+    """
+    Cubic Hermite interpolation of log discount factors. Slope at each pillar is taken from the parabola through
+    the pillar and its two neighbours, so a change of one pillar affects only the two adjacent segments on each side
+    and is applied by update() in constant time.
+    """
+
+    def __init__(self, times, logdf):
+        self.x = np.array(times, dtype=np.float64)
+        self.y = np.array(logdf, dtype=np.float64)
+        self.h = np.diff(self.x)
+        self.d = np.diff(self.y, axis=-1) / self.h
+        self.m = np.empty_like(self.y)
+        self.m[..., 0] = self.d[..., 0]
+        self.m[..., -1] = self.d[..., -1]
+        h, d = self.h, self.d
+        self.m[..., 1:-1] = (h[1:] * d[..., :-1] + h[:-1] * d[..., 1:]) / (h[:-1] + h[1:])
+        # Polynomial coefficients of each segment in s = (t - x[k]) / h[k], constant term is y[k]
+        self.c = np.empty((3,) + self.d.shape)
+        self.calc_coefficients(0, len(self.h))
+
+    def calc_slope(self, i):
+        if i == 0:
+            return self.d[..., 0]
+        if i == len(self.x) - 1:
+            return self.d[..., -1]
+        h, d = self.h, self.d
+        return (h[i] * d[..., i - 1] + h[i - 1] * d[..., i]) / (h[i - 1] + h[i])
+
+    def calc_coefficients(self, begin, end):
+        h = self.h[begin:end]
+        dy = self.y[..., begin + 1:end + 1] - self.y[..., begin:end]
+        m0, m1 = self.m[..., begin:end] * h, self.m[..., begin + 1:end + 1] * h
+        self.c[0, ..., begin:end] = m0
+        self.c[1, ..., begin:end] = 3 * dy - 2 * m0 - m1
+        self.c[2, ..., begin:end] = m0 + m1 - 2 * dy
+
+    def update(self, i, logdf):
+        n = len(self.x)
+        self.y[..., i] = logdf
+        for j in range(max(i - 1, 0), min(i + 1, n - 1)):
+            self.d[..., j] = (self.y[..., j + 1] - self.y[..., j]) / self.h[j]
+        for j in range(max(i - 1, 0), min(i + 2, n)):
+            self.m[..., j] = self.calc_slope(j)
+        self.calc_coefficients(max(i - 2, 0), min(i + 2, n - 1))
+
+    def __copy__(self):
+        # Pillar times are never updated and can be shared
+        interpolator = self.__class__.__new__(self.__class__)
+        interpolator.x, interpolator.h = self.x, self.h
+        interpolator.y, interpolator.d, interpolator.m, interpolator.c = \
+            self.y.copy(), self.d.copy(), self.m.copy(), self.c.copy()
+        return interpolator
+
+    def value(self, t):
+        t = np.asarray(t, dtype=np.float64)
+        if t.size > 0 and (t.min() < self.x[0] or t.max() > self.x[-1]):
+            raise BaseException("Dates are outside of the interpolation range")
+        k = np.searchsorted(self.x[1:-1], t, side='right')
+        s = (t - self.x[k]) / self.h[k]
+        c = self.c[..., k]
+        return np.exp(self.y[..., k] + s * (c[0] + s * (c[1] + s * c[2])))
+
+
 class Curve:
     def __init__(self, curve_id, eval_date, times, dfs, interpolation_mode: InterpolationMode):
         try:
@@ -110,28 +533,53 @@ class Curve:
             self.id_ = curve_id
             self.times_ = np.append(eval_date, times)
             self.dfs_ = np.append(1., dfs)
+            self.query_cache_ = QueryCache()
+            self.frozen_ = False
+            self.materialized_ = False
+            self.dense_dfs_ = None
+            self.dense_version_ = None
             self.set_interpolator(interpolation_mode)
         except BaseException as ex:
             raise BaseException("Unable to create curve %s" % curve_id) from ex
 
     def add_another_curve(self, another_curve):
+        self.check_not_frozen()
         assert isinstance(another_curve, Curve)
         assert all(self.times_ == another_curve.times_)
         self.dfs_ = another_curve.dfs_ * self.dfs_
         self.set_interpolator(self.interpolation_mode_)
 
     def set_interpolator(self, interpolation_mode: Optional[InterpolationMode] = None):
+        self.check_not_frozen()
         if interpolation_mode is not None:
             self.interpolation_mode_ = interpolation_mode
+        if self.interpolation_mode_ not in [LINEAR_LOGDF, LINEAR_CCZR, CUBIC_LOGDF, HERMITE_LOGDF]:
+            raise BaseException(
+                "Invalid interpolation mode. Allowed modes are %s" % enum_values_as_string(InterpolationMode))
+        #
+        assert len(self.times_) == self.dfs_.shape[-1], (len(self.times_), self.dfs_.shape[-1])
+        #
+        self.interpolator_ = None  # Interpolator is built lazily on first use
+        self.interpolator_shared_ = False
+        self.update_version()
+
+    def update_version(self):
+        self.version_ = next(curve_versions)
+        self.query_cache_.clear()
+
+    def get_interpolator(self):
+        if self.interpolator_ is not None:
+            return self.interpolator_
+        if self.interpolation_mode_ == HERMITE_LOGDF:
+            self.interpolator_ = LocalHermiteInterpolator(self.times_, np.log(self.dfs_))
+            return self.interpolator_
+        import scipy.interpolate
         if self.interpolation_mode_ in [LINEAR_LOGDF, LINEAR_CCZR]:
             kind = 'linear'
         elif self.interpolation_mode_ in [CUBIC_LOGDF]:
             kind = 'cubic'
         else:
-            raise BaseException(
-                "Invalid interpolation mode. Allowed modes are %s" % enum_values_as_string(InterpolationMode))
-        #
-        assert len(self.times_) == len(self.dfs_), (len(self.times_), len(self.dfs_))
+            raise BaseException("Invalid interpolation mode")
         #
         if self.interpolation_mode_ in [LINEAR_LOGDF, CUBIC_LOGDF]:
             logdf = np.log(self.dfs_)
@@ -140,12 +588,13 @@ class Curve:
         elif self.interpolation_mode_ in [LINEAR_CCZR]:
             t_eval = self.times_[0]
             t_rel = self.times_ - t_eval
-            cczr1 = np.log(self.dfs_[1:]) / t_rel[1:]
-            cczr = np.insert(cczr1, 0, cczr1[0])  # ZZCR at t0 is undefined, take it from t1 instead
+            cczr1 = np.log(self.dfs_[..., 1:]) / t_rel[1:]
+            cczr = np.concatenate((cczr1[..., :1], cczr1), axis=-1)  # ZZCR at t0 is undefined, take it from t1 instead
             interp = scipy.interpolate.interp1d(self.times_, cczr, kind=kind)
             self.interpolator_ = ZeroRateInterpolator(interp, t_eval)
         else:
             raise BaseException("Invalid interpolation mode")
+        return self.interpolator_
 
     def __str__(self):
         return self.id_
@@ -153,61 +602,199 @@ class Curve:
     def get_id(self):
         return self.id_
 
+    def freeze(self):
+        # Frozen curve can be queried from many threads, lazily built state is built here upfront
+        self.get_interpolator()
+        if self.materialized_:
+            self.get_dense_dfs()
+        self.dfs_.setflags(write=False)
+        self.frozen_ = True
+
+    def is_frozen(self):
+        return self.frozen_
+
+    def check_not_frozen(self):
+        if self.frozen_:
+            raise BaseException("Curve %s is frozen and cannot be modified" % self.id_)
+
+    def __getstate__(self):
+        # Only the curve definition is serialized, interpolator, dense grid and cached query results are rebuilt
+        # lazily and the version is assigned anew
+        state = self.__dict__.copy()
+        for name in ['interpolator_', 'interpolator_shared_', 'version_', 'dense_dfs_', 'dense_version_']:
+            del state[name]
+        state['query_cache_'] = self.query_cache_.max_size
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        frozen = state.pop('frozen_')
+        self.__dict__.update(state)
+        self.query_cache_ = QueryCache(state['query_cache_'])
+        self.frozen_ = False
+        self.dense_dfs_ = None
+        self.dense_version_ = None
+        self.set_interpolator()
+        if frozen:
+            self.freeze()
+
+    def __copy__(self):
+        # Shallow copy shares pillar times and interpolator, but has its own discount factors, version and query
+        # cache. Copy is not materialized, copies are mostly bumped and rebuilding the dense grid would dominate
+        # the bump.
+        curve = self.__class__.__new__(self.__class__)
+        curve.__dict__.update(self.__dict__)
+        curve.dfs_ = self.dfs_.copy()
+        curve.dfs_.setflags(write=not self.frozen_)
+        curve.query_cache_ = QueryCache(self.query_cache_.max_size)
+        curve.materialized_ = False
+        curve.dense_dfs_ = None
+        curve.dense_version_ = None
+        if self.interpolator_ is not None:
+            # Neither curve updates the shared interpolator in place, it is cloned by set_dof first
+            self.interpolator_shared_ = True
+            curve.interpolator_shared_ = True
+        curve.update_version()
+        return curve
+
+    def __deepcopy__(self, memo):
+        curve = self.__class__.__new__(self.__class__)
+        memo[id(self)] = curve
+        curve.__setstate__(copy.deepcopy(self.__getstate__(), memo))
+        return curve
+
+    def get_version(self):
+        # Changes whenever discount factors or interpolation of the curve change
+        return self.version_
+
+    def get_cache_stats(self):
+        return self.query_cache_.get_stats()
+
+    def set_cache_size(self, max_size):
+        self.query_cache_ = QueryCache(max_size)
+
+    def set_cache_enabled(self, enabled):
+        # Disabled while the curve is being solved, results of solver evaluations are never queried again
+        self.query_cache_.enabled = enabled
+        self.query_cache_.clear()
+
     def get_df(self, t):
+        # Results for numpy arrays are memoized, every call returns a new writable array
+        if not isinstance(t, np.ndarray) or not self.query_cache_.is_enabled():
+            return self.calc_df(t)
+        key = (self.get_version(), CurveQuantity.DF, QueryCache.array_key(t))
+        return self.query_cache_.get(key, lambda: self.calc_df(t))
+
+    def set_materialized(self, materialized=True):
+        # Materialized curve keeps discount factors for every day between first and last pillar,
+        # discount factors for integer dates are then looked up instead of interpolated
+        self.check_not_frozen()
+        self.materialized_ = materialized
+        if not materialized:
+            self.dense_dfs_ = None
+            self.dense_version_ = None
+
+    def is_materialized(self):
+        return self.materialized_
+
+    def get_dense_dfs(self):
+        # Rebuilt lazily whenever the curve version changes, element i corresponds to date times_[0] + i
+        if self.dense_version_ != self.version_:
+            days = np.arange(self.times_[0], np.floor(self.times_[-1]) + 1)
+            self.dense_dfs_ = self.get_interpolator().value(days)
+            self.dense_version_ = self.version_
+        return self.dense_dfs_
+
+    def calc_dense_df(self, t):
+        # Returns None when some of the dates are fractional or outside of the grid
+        t = np.asarray(t)
+        if t.dtype.kind == 'f':
+            if not np.all(np.floor(t) == t):
+                return None
+        elif t.dtype.kind not in 'iu':
+            return None
+        dense_dfs = self.get_dense_dfs()
+        ix = (t - self.times_[0]).astype(np.intp)
+        if ix.size > 0 and (ix.min() < 0 or ix.max() >= dense_dfs.shape[-1]):
+            return None
+        return dense_dfs[..., ix]
+
+    def calc_df(self, t):
+        if self.materialized_ and float(self.times_[0]).is_integer():
+            dfs = self.calc_dense_df(t)
+            if dfs is not None:
+                return dfs
         try:
-            return self.interpolator_.value(t)
+            return self.get_interpolator().value(t)
         except BaseException as ex:
             raise BaseException(
                 "Unable to get discount factor for dates [%i..%i] from curve with dates range [%i..%i]" % (
                     t[0], t[-1], self.times_[0], self.times_[-1])) from ex
 
     def get_zero_rate(self, t, freq, dcc):
-        dfs = self.get_df(t)
-        dcf = calculate_dcf(self.times_[0], t, dcc)
-        if freq == ZEROFREQ:
-            return (1. / dfs - 1.) / dcf
-        if freq == CONTINUOUS:
-            return -np.log(dfs) / dcf
+        calc = lambda: zero_rate_from_dfs(self.times_[0], t, self.get_df(t), freq, dcc)
+        if not isinstance(t, np.ndarray) or not self.query_cache_.is_enabled():
+            return calc()
+        key = (self.get_version(), CurveQuantity.ZR, freq, dcc, QueryCache.array_key(t))
+        return self.query_cache_.get(key, calc)
 
     def get_fwd_rate(self, t_start, t_end, freq, dcc):
-        dfs_start = self.get_df(t_start)
-        dfs_end = self.get_df(t_end)
-        dcf = calculate_dcf(t_start, t_end, dcc)
-        if freq == ZEROFREQ:
-            return (dfs_start / dfs_end - 1) / dcf
-        if freq == CONTINUOUS:
-            return np.log(dfs_start / dfs_end) / dcf
+        return fwd_rate_from_dfs(t_start, t_end, self.get_df(t_start), self.get_df(t_end), freq, dcc)
 
     def get_fwd_rate_aligned(self, t, freq: CouponFreq, dcc: DCC):
         # Slightly faster version which relies on the fact that calculation periods are aligned (no overlaps, no gaps)
-        dfs = self.get_df(t)
-        t1 = t[:-1]
-        t2 = t[1:]
-        df1 = dfs[:-1]
-        df2 = dfs[1:]
-        dcf = calculate_dcf(t1, t2, dcc)
-        if freq == ZEROFREQ:
-            return (df1 / df2 - 1) / dcf
-        if freq == CONTINUOUS:
-            return np.log(df1 / df2) / dcf
+        def calc():
+            dfs = self.get_df(t)
+            return fwd_rate_from_dfs(t[:-1], t[1:], dfs[..., :-1], dfs[..., 1:], freq, dcc)
+
+        if not isinstance(t, np.ndarray) or not self.query_cache_.is_enabled():
+            return calc()
+        key = (self.get_version(), CurveQuantity.FWD, freq, dcc, QueryCache.array_key(t))
+        return self.query_cache_.get(key, calc)
 
     def set_all_dofs(self, dofs):
+        self.check_not_frozen()
         self.dfs_ = np.append([1], dofs)
         self.set_interpolator()
 
+    def set_dof(self, i, dof):
+        # Interpolators with local support are updated in place, other interpolators are rebuilt on next use
+        self.check_not_frozen()
+        self.dfs_[..., i + 1] = dof
+        if self.interpolator_ is not None and self.has_local_interpolation():
+            if self.interpolator_shared_:
+                self.interpolator_ = copy.copy(self.interpolator_)
+                self.interpolator_shared_ = False
+            self.interpolator_.update(i + 1, np.log(dof))
+            self.update_version()
+        else:
+            self.set_interpolator()
+
+    def has_local_interpolation(self):
+        return self.interpolation_mode_ == HERMITE_LOGDF
+
     def get_all_dofs(self):
         return self.dfs_[1:]
 
     def get_dofs_count(self):
         return len(self.dfs_) - 1
 
+    def create_bumped(self, dofs_deltas):
+        # Bumped curve shares the pillar times with this curve, only discount factors are copied
+        curve = copy.copy(self)
+        curve.frozen_ = False
+        curve.set_all_dofs(self.get_all_dofs() + dofs_deltas)
+        return curve
+
     def plot(self, date_style=PlotDate.YMD, mode=PlotMode.FWD, samples=1000, label=None, convention=None):
         import pylab
         import matplotlib.pyplot as plt
         timesample = np.linspace(self.times_[0], self.times_[-1], samples)
+        if self.materialized_:
+            timesample = np.unique(np.floor(timesample))  # Whole days only, these are served from the dense grid
         X = timesample
         if date_style == PlotDate.YMD:
-            X = [exceldate_to_pydate(int(x)) for x in X]
+            X = exceldates_to_datetime64(X)
         elif date_style == PlotDate.TENOR:
             ax = plt.subplot()
             PlottingHelper.set_tenors_on_axis(ax, self.times_[0])
@@ -219,18 +806,109 @@ class Curve:
         if mode == PlotMode.FWD:
             convention = global_conventions.get(self.id_) if convention is None else convention
             Y = self.get_fwd_rate_aligned(timesample, ZEROFREQ, convention.dcc)
-            pylab.plot(X[:-1], Y, label=self.id_ if label is None else label)
+            pylab.plot(X[:-1], Y.T, label=self.id_ if label is None else label)
         elif mode == PlotMode.ZR:
             convention = global_conventions.get(self.id_) if convention is None else convention
             Y = self.get_zero_rate(timesample[1:], ZEROFREQ, convention.dcc)
-            pylab.plot(X[:-1], Y, label=self.id_ if label is None else label)
+            pylab.plot(X[:-1], Y.T, label=self.id_ if label is None else label)
         elif mode == PlotMode.DF:
             Y = self.get_df(timesample)
-            pylab.plot(X, Y, label=self.id_ if label is None else label)
+            pylab.plot(X, Y.T, label=self.id_ if label is None else label)
         else:
             raise BaseException("Unknown PlottingMode")
 
 
+class ScenarioCurve(Curve):
+    """
+    Curve with one vector of discount factors per scenario, all scenarios share the same pillar times.
+    Discount factors are stored as a matrix with Rows=Scenarios and Cols=Pillars and all queries (get_df,
+    get_zero_rate, get_fwd_rate, get_fwd_rate_aligned) return matrices with Rows=Scenarios and Cols=Dates,
+    evaluated in a single interpolation pass.
+    """
+
+    def __init__(self, curve_id, eval_date, times, dfs, interpolation_mode: InterpolationMode):
+        try:
+            times, dfs = np.array(times), np.array(dfs, dtype=np.float64)
+            assert len(times) > 0, "Vector of times is empty"
+            assert dfs.ndim == 2, "Discount factors must be a matrix with Rows=Scenarios and Cols=Pillars"
+            assert times[
+                       0] != eval_date, "DF at eval date cannot be provided externally. It is assumed to be 1.0 always."
+            self.id_ = curve_id
+            self.times_ = np.append(eval_date, times)
+            self.dfs_ = np.hstack((np.ones((dfs.shape[0], 1)), dfs))
+            self.query_cache_ = QueryCache()
+            self.frozen_ = False
+            self.materialized_ = False
+            self.dense_dfs_ = None
+            self.dense_version_ = None
+            self.set_interpolator(interpolation_mode)
+        except BaseException as ex:
+            raise BaseException("Unable to create curve %s" % curve_id) from ex
+
+    def get_scenario_count(self):
+        return self.dfs_.shape[0]
+
+    def get_scenario(self, i) -> Curve:
+        return Curve(self.id_, self.times_[0], self.times_[1:], self.dfs_[i, 1:], self.interpolation_mode_)
+
+    def set_all_dofs(self, dofs):
+        self.check_not_frozen()
+        dofs = np.array(dofs, dtype=np.float64)
+        self.dfs_ = np.hstack((np.ones((dofs.shape[0], 1)), dofs))
+        self.set_interpolator()
+
+    def get_all_dofs(self):
+        return self.dfs_[:, 1:]
+
+    def get_dofs_count(self):
+        return self.dfs_.shape[1] - 1
+
+
+class SpreadCurve(Curve):
+    """
+    Curve defined as a live base curve multiplied by its own spread discount factors. Pillars, DOFs and interpolation
+    of this curve describe only the spread and can be on a different grid than the base curve. The base curve is held
+    by reference, so its changes are visible immediately, cached query results are keyed by versions of both curves.
+    Freezing the spread curve freezes its base curve as well.
+    """
+
+    def __init__(self, curve_id, base_curve: Curve, eval_date, times, dfs, interpolation_mode: InterpolationMode):
+        assert_type(base_curve, Curve)
+        if base_curve.times_[0] != eval_date:
+            raise BaseException("Unable to create curve %s, eval date of base curve %s is %i" % (
+                curve_id, base_curve, base_curve.times_[0]))
+        self.base_ = base_curve
+        super(SpreadCurve, self).__init__(curve_id, eval_date, times, dfs, interpolation_mode)
+
+    @staticmethod
+    def FromCurves(curve_id, base_curve: Curve, spread_curve: Curve):
+        return SpreadCurve(curve_id, base_curve, spread_curve.times_[0], spread_curve.times_[1:],
+                           spread_curve.dfs_[1:], spread_curve.interpolation_mode_)
+
+    def get_base(self):
+        return self.base_
+
+    def create_rebased(self, base_curve: Curve):
+        # Rebased curve shares the spread with this curve, only the base curve is replaced
+        assert_type(base_curve, Curve)
+        curve = copy.copy(self)
+        curve.base_ = base_curve
+        return curve
+
+    def freeze(self):
+        self.base_.freeze()
+        super(SpreadCurve, self).freeze()
+
+    def get_version(self):
+        return self.version_, self.base_.get_version()
+
+    def get_spread_df(self, t):
+        return super(SpreadCurve, self).calc_df(t)
+
+    def calc_df(self, t):
+        return self.base_.get_df(t) * self.get_spread_df(t)
+
+
 class CurveConstructor:
     @staticmethod
     def FromShortRateModel(curve_id, times, r0: float, speed: float, mean: float, sigma: float,
@@ -249,3 +927,38 @@ class CurveConstructor:
         dfs_fwd = np.exp(-rates * dts)
         dfs = np.cumprod(dfs_fwd)
         return Curve(curve_id, times[0], times[1:], dfs, interpolation)
+
+    @staticmethod
+    def FromShortRateModelScenarios(curve_id, times, r0: float, speed: float, mean: float, sigma: float,
+                                    interpolation: InterpolationMode, scenarios: int, seed=None, processes=None,
+                                    chunk_size: int = 1000, return_dofs: bool = False):
+        # Same model as FromShortRateModel, all scenarios are simulated at once using numpy Generator.
+        # Scenarios are split into chunks, each chunk has its own random stream spawned from the seed,
+        # so the output depends only on seed and chunk_size, not on the number of processes.
+        times = np.array(times)
+        dts = (times[1:] - times[:-1]) / 365.
+        chunk_sizes = [min(chunk_size, scenarios - i) for i in range(0, scenarios, chunk_size)]
+        seed_sequences = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+        args = [(s, n, dts, r0, speed, mean, sigma) for s, n in zip(seed_sequences, chunk_sizes)]
+        if processes is None or processes == 1:
+            chunks = [simulate_short_rate_dfs(*a) for a in args]
+        else:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                chunks = list(executor.map(simulate_short_rate_dfs, *zip(*args)))
+        dfs = np.vstack(chunks)
+        if return_dofs:
+            return dfs
+        return ScenarioCurve(curve_id, times[0], times[1:], dfs, interpolation)
+
+
+def simulate_short_rate_dfs(seed_sequence, scenarios: int, dts, r0: float, speed: float, mean: float, sigma: float):
+    # Returns discount factors with Rows=Scenarios and Cols=Pillars (excluding eval date)
+    rng = np.random.default_rng(seed_sequence)
+    shocks = rng.standard_normal((scenarios, len(dts))) * np.sqrt(dts)
+    rates = np.empty((scenarios, len(dts)))
+    r = np.full(scenarios, r0, dtype=np.float64)
+    for i, dt in enumerate(dts):
+        rates[:, i] = r
+        r = r + speed * (mean - r) * dt + sigma * shocks[:, i]
+    return np.exp(-np.cumsum(rates * dts, axis=1))
@@ -2,23 +2,23 @@
 # http://github.com/omartinsky/pybor
 import collections
 import re
+from typing import Optional
 
 import numpy
 from collections import OrderedDict, defaultdict
 
-from pandas import *
-import scipy.optimize
 import copy, os
 
 from instruments.basisswap import BasisSwap
 from instruments.crosscurrencyswap import CrossCurrencySwap
 from instruments.deposit import Deposit
 from instruments.future import Future
+from instruments.instrument_table import InstrumentTable
 from instruments.mtmcrosscurrencybasisswap import MtmCrossCurrencyBasisSwap
 from instruments.swap import Swap
 from instruments.termdeposit import TermDeposit
 from instruments.zerorate import ZeroRate
-from yc_curve import CurveMap, InterpolationMode, Curve
+from yc_curve import CurveMap, CurveMapPublisher, InterpolationMode, Curve
 from yc_helpers import enum_from_string
 import numpy as np
 
@@ -62,12 +62,14 @@ class BuildOutput:
 class PriceLadder(collections.OrderedDict):
 
     @staticmethod
-    def create(data: DataFrame):
-        if isinstance(data, DataFrame):
+    def create(data):
+        # Data is a dict or a pandas DataFrame with column Price
+        if isinstance(data, dict):
+            return PriceLadder(data)
+        import pandas
+        if isinstance(data, pandas.DataFrame):
             od = collections.OrderedDict(data['Price'])
             return PriceLadder(od)
-        elif isinstance(data, dict):
-            return PriceLadder(data)
         else:
             raise BaseException("Unknown data type %s" % type(data))
 
@@ -82,32 +84,46 @@ class PriceLadder(collections.OrderedDict):
         return PriceLadder.create(OrderedDict(l))
 
     def dataframe(self):
-        df = DataFrame.from_dict(self, orient='index')
+        import pandas
+        df = pandas.DataFrame.from_dict(self, orient='index')
         df.columns = ['Price']
         return df
 
 
-def calc_residual(curvemap, instrument_prices, instrument):
-    r_actual = instrument.calc_par_rate(curvemap)
-    price = instrument_prices[instrument.name_]
-    r_target = instrument.par_rate_from_price(price)
-    return r_actual - r_target
-
-
 def calc_residuals(dofs, curve_builder, curvemap, instrument_prices, curves_for_stage, instruments_for_stage):
     if curve_builder.progress_monitor:
         curve_builder.progress_monitor.update()
     assert not numpy.isnan(dofs).any()
     curvemap.set_all_dofs(curves_for_stage, dofs)
 
-    y = [calc_residual(curvemap, instrument_prices, i) for i in instruments_for_stage]
-    return y
+    table = curve_builder.get_instrument_table(instruments_for_stage)
+    return table.calc_par_rates(curvemap) - table.par_rates_from_prices(instrument_prices)
+
+
+def calc_residuals_jacobian(dofs, curve_builder, curvemap, instrument_prices, curves_for_stage, instruments_for_stage,
+                            bump_size=1e-8):
+    # Forward-difference jacobian Rows=Instruments Cols=Pillars. Pillars are bumped one at a time, so curves with
+    # local interpolation only update the segments around the bumped pillar.
+    e0 = np.array(calc_residuals(dofs, curve_builder, curvemap, instrument_prices, curves_for_stage,
+                                 instruments_for_stage))
+    table = curve_builder.get_instrument_table(instruments_for_stage)
+    r_target = table.par_rates_from_prices(instrument_prices)
+    jacobian = np.empty((len(e0), len(dofs)))
+    for i, dof in enumerate(dofs):
+        if curve_builder.progress_monitor:
+            curve_builder.progress_monitor.update()
+        curvemap.set_dof(curves_for_stage, i, dof + bump_size)
+        e = table.calc_par_rates(curvemap) - r_target
+        jacobian[:, i] = (e - e0) / bump_size
+        curvemap.set_dof(curves_for_stage, i, dof)
+    return jacobian
 
 
 class CurveBuilder:
     def __init__(self, excel_file, eval_date, progress_monitor=None):
+        import pandas
         assert os.path.exists(excel_file)
-        xl = ExcelFile(excel_file)
+        xl = pandas.ExcelFile(excel_file)
         self.df_instruments = xl.parse('Instrument Properties', index_col='Name', parse_cols='A:L')
         self.df_curves = xl.parse('Curve Properties', index_col='Curve', parse_cols='A:C')
         if (len(self.df_curves) == 0):
@@ -118,6 +134,7 @@ class CurveBuilder:
 
         self.all_instruments = list()
         self.instrument_positions = dict()
+        self.instrument_tables = dict()
 
         for curve_name in list(self.df_curves.index):  # Order of curves determined by XLS file:
             curve_template = CurveTemplate(curve_name)
@@ -191,16 +208,21 @@ class CurveBuilder:
                     instruments_for_stage.append(i)
         return instruments_for_stage
 
+    def get_instrument_table(self, instruments) -> InstrumentTable:
+        # Columnar tables are created once for each list of instruments (e.g. instruments of one solve stage)
+        key = tuple(i.get_name() for i in instruments)
+        if key not in self.instrument_tables:
+            self.instrument_tables[key] = InstrumentTable(instruments)
+        return self.instrument_tables[key]
+
     def reprice(self, curvemap):
-        out = OrderedDict()
-        for curve_template in self.curve_templates:
-            for instrument in curve_template.instruments:
-                if (curvemap):
-                    rate = instrument.calc_par_rate(curvemap)
-                    out[instrument.name_] = instrument.price_from_par_rate(rate)
-                else:  # If curvemap is not provided, generated price ladder will contain zeros.
-                    out[instrument.name_] = 0.0
-        return PriceLadder(out)
+        all_instruments = self.get_instruments_for_stage(self.get_curve_names())
+        if (curvemap):
+            table = self.get_instrument_table(all_instruments)
+            prices = table.prices_from_par_rates(table.calc_par_rates(curvemap))
+        else:  # If curvemap is not provided, generated price ladder will contain zeros.
+            prices = np.zeros(len(all_instruments))
+        return PriceLadder(OrderedDict(zip([i.get_name() for i in all_instruments], prices)))
 
     def get_instrument_rates(self, price_ladder):
         maturities = [self.get_instrument_by_name(name).get_pillar_date() for name in price_ladder.keys()]
@@ -210,7 +232,8 @@ class CurveBuilder:
     def parse_instrument_prices(self, prices):
         if isinstance(prices, dict):
             return prices
-        elif isinstance(prices, pandas.DataFrame):
+        import pandas
+        if isinstance(prices, pandas.DataFrame):
             try:
                 return dict(zip(prices['Instrument'], prices['Price']))
             except BaseException as ex:
@@ -237,14 +260,41 @@ class CurveBuilder:
             curvemap.add_curve(curve)
         return curvemap
 
-    def build_curves(self, instrument_prices):
+    def get_first_affected_stage(self, instrument_names):
+        # Solve stages before the returned one do not depend on prices of given instruments
+        affected_curves = set()
+        for curve_template in self.curve_templates:
+            for instrument in curve_template.instruments:
+                if instrument.get_name() in instrument_names:
+                    affected_curves.add(curve_template.curve_name)
+        stages = self.get_solve_stages()
+        for iStage, curves_for_stage in enumerate(stages):
+            if len(affected_curves & curves_for_stage) > 0:
+                return iStage
+        return len(stages)
+
+    def build_curves(self, instrument_prices, solved_curvemap=None, first_stage=0,
+                     publisher: Optional[CurveMapPublisher] = None):
+        # Stages before first_stage are not solved, their curves are taken from solved_curvemap as they are.
+        # When publisher is provided, output curvemap is frozen and published as the new snapshot.
         instrument_prices = self.parse_instrument_prices(instrument_prices)
 
         curvemap = self.create_initial_curvemap(0.02)  # Create unoptimized curve map
+        # Every solver evaluation queries the curves at new DOFs, query cache is only enabled on the output curves
+        all_curves = self.get_curve_names()
+        curvemap.set_cache_enabled(all_curves, False)
 
         stages = self.get_solve_stages()
 
+        if first_stage > 0:
+            if solved_curvemap is None:
+                raise BaseException("Solved curvemap is required when building curves from stage %i" % first_stage)
+            solved_curves = set().union(*stages[:first_stage])
+            curvemap.set_all_dofs(solved_curves, solved_curvemap.get_all_dofs(solved_curves))
+
         for iStage, curves_for_stage in enumerate(stages):
+            if iStage < first_stage:
+                continue
             instruments_for_stage = self.get_instruments_for_stage(curves_for_stage)
             dofs = curvemap.get_all_dofs(curves_for_stage)
             print("Solving stage %i/%i containing curves %s (%i pillars)" % (
@@ -255,7 +305,12 @@ class CurveBuilder:
 
             arguments = (self, curvemap, instrument_prices, curves_for_stage, instruments_for_stage)
             bounds = (np.zeros(len(dofs)), numpy.inf * np.ones(len(dofs)))
-            solution = scipy.optimize.least_squares(fun=calc_residuals, x0=dofs, args=arguments, bounds=bounds)
+            # Analytic jacobian is not available, but with local interpolation pillar-by-pillar bumps are cheaper
+            # than the default finite-difference scheme which resets all the curves for each column
+            jac = calc_residuals_jacobian if curvemap.has_local_interpolation(curves_for_stage) else '2-point'
+            import scipy.optimize
+            solution = scipy.optimize.least_squares(fun=calc_residuals, x0=dofs, jac=jac, args=arguments,
+                                                    bounds=bounds)
 
             assert isinstance(solution, scipy.optimize.OptimizeResult)
 
@@ -263,25 +318,24 @@ class CurveBuilder:
                 raise BaseException(solution.message)
             curvemap.set_all_dofs(curves_for_stage, solution.x)
 
-        # calculate jacobian matrix
-        bump_size = 1e-8
-        final_solution = curvemap.get_all_dofs(curvemap.keys())
+        jacobian_dIdP = self.calc_jacobian(curvemap, instrument_prices)
+        curvemap.set_cache_enabled(all_curves, True)
+
+        if publisher is not None:
+            publisher.publish(curvemap)
+
+        print("Done")
+        return BuildOutput(instrument_prices, curvemap, jacobian_dIdP, self.all_instruments)
+
+    def calc_jacobian(self, curvemap, instrument_prices):
         all_curves = [curve_template.curve_name for curve_template in self.curve_templates]
+        final_solution = curvemap.get_all_dofs(all_curves)
         all_instruments = self.get_instruments_for_stage(all_curves)
         arguments = (self, curvemap, instrument_prices, all_curves, all_instruments)
-        e0 = np.array(calc_residuals(final_solution, *arguments))
-        jacobian_dIdP = []
-        for i in range(len(final_solution)):
-            bump_vector = np.zeros(len(final_solution))
-            bump_vector[i] += bump_size
-            e = np.array(calc_residuals(final_solution + bump_vector, *arguments))
-            jacobian_dIdP.append((e - e0) / bump_size)
+        jacobian_dIdP = calc_residuals_jacobian(final_solution, *arguments).T
         # this jacobian_dIdP contains dI/dP.  Rows=Pillars  Cols=Instruments
         # after inversion, it will contain dP/dI.   Rows=Instruments   Cols=Pillars
-        jacobian_dIdP = np.array(jacobian_dIdP)
-
-        print("Done")
-        return BuildOutput(instrument_prices, curvemap, jacobian_dIdP, self.all_instruments)
+        return jacobian_dIdP
 
     def get_instrument_by_name(self, name):
         pos = self.instrument_positions[name]
@@ -3,32 +3,62 @@
 
 from dateutil.relativedelta import relativedelta
 import dateutil.parser
-import enum, calendar, datetime
+import enum, calendar, datetime, functools
 import datetime as dt
 import numpy as np
 
 
 class Tenor:
-    def __init__(self, s):
+    """
+    Tenors are immutable and interned, Tenor(s) returns the same instance for the same string
+    """
+    __slots__ = ['string', 'n', 'unit', 'neg']
+    parsed = dict()
+
+    def __new__(cls, s):
+        tenor = Tenor.parsed.get(s) if isinstance(s, str) else None
+        if tenor is not None:
+            return tenor
         try:
             assert isinstance(s, str)
-            self.string = s
-            self.n = s[:-1]
-            self.n = int(self.n) if self.n != "" else 0
-            self.unit = s[-1:]
-            assert self.unit in ['F', 'D', 'M', 'Q', 'Y']
+            n = int(s[:-1]) if s[:-1] != "" else 0
+            unit = s[-1:]
+            assert unit in ['F', 'D', 'M', 'Q', 'Y']
         except BaseException as ex:
             raise BaseException("Unable to parse tenor %s" % s) from ex
+        tenor = super(Tenor, cls).__new__(cls)
+        object.__setattr__(tenor, 'string', s)
+        object.__setattr__(tenor, 'n', n)
+        object.__setattr__(tenor, 'unit', unit)
+        object.__setattr__(tenor, 'neg', None)
+        return Tenor.parsed.setdefault(s, tenor)
+
+    def __setattr__(self, key, value):
+        raise BaseException("Tenor %s is immutable" % self.string)
+
+    def __reduce__(self):
+        return Tenor, (self.string,)
 
     def __eq__(self, other):
+        if not isinstance(other, Tenor):
+            return NotImplemented
         return self.string == other.string
 
+    def __hash__(self):
+        return hash((Tenor, self.string))
+
     def __neg__(self):
-        return Tenor("-%s" % self.string) if self.string[0] != "-" else Tenor(self.string[1:])
+        if self.neg is None:
+            neg = Tenor("-%s" % self.string) if self.string[0] != "-" else Tenor(self.string[1:])
+            object.__setattr__(self, 'neg', neg)
+        return self.neg
 
     def __str__(self):
         return self.string
 
+    def __repr__(self):
+        return "Tenor('%s')" % self.string
+
 
 class RollType(enum.Enum):
     NONE = 0
@@ -53,17 +83,32 @@ BACK_STUB_SHORT = StubType.BACK_STUB_SHORT
 BACK_STUB_LONG = StubType.BACK_STUB_LONG
 
 excelBaseDate = datetime.date(1899, 12, 30)
+excelEpochDate = 25569  # Excel date of 1970-01-01, which is the epoch of numpy.datetime64
+
+
+def check_exceldates(d):
+    assert np.all(np.asarray(d) >= 61), \
+        "Do not allow dates below 1 March 1900, Excel incorrectly assumes 1900 is a leap year"
+
+
+def exceldates_to_datetime64(d) -> np.ndarray:
+    d = np.asarray(d).astype(np.int64)
+    check_exceldates(d)
+    return (d - excelEpochDate).astype('datetime64[D]')
+
+
+def datetime64_to_exceldates(d) -> np.ndarray:
+    d = np.asarray(d, dtype='datetime64[D]').astype(np.int64) + excelEpochDate
+    check_exceldates(d)
+    return d
 
 
 def pydate_to_exceldate(d: dt.date) -> int:
-    xldate = int((d - excelBaseDate).days)
-    assert xldate >= 61, "Do not allow dates below 1 March 1900, Excel incorrectly assumes 1900 is a leap year"
-    return xldate
+    return int(datetime64_to_exceldates(np.datetime64(d, 'D')))
 
 
 def exceldate_to_pydate(d: int) -> dt.date:
-    assert d >= 61, "Do not allow dates below 1 March 1900, Excel incorrectly assumes 1900 is a leap year"
-    return excelBaseDate + relativedelta(days=d)
+    return exceldates_to_datetime64(d).item()
 
 
 def create_relativedelta(n: int, unit: str) -> relativedelta:
@@ -81,6 +126,8 @@ def create_relativedelta(n: int, unit: str) -> relativedelta:
 
 def next_imm_date(d: dt.date) -> dt.date:
     assert isinstance(d, dt.date)
+    if imm_table_range[0] <= d < imm_table_range[1]:
+        return exceldate_to_pydate(int(next_imm_dates(pydate_to_exceldate(d))))
 
     def third_wednesday(d: dt.date) -> int:
         d = d.replace(day=1)
@@ -96,47 +143,139 @@ def next_imm_date(d: dt.date) -> dt.date:
         return d.replace(day=third_wednesday(d))
 
 
-def date_step(date: int, tenor: Tenor, preserve_eom: bool = False):
+# IMM dates are looked up in a table for dates in this range and calculated outside of it
+imm_table_range = (datetime.date(1900, 3, 1), datetime.date(2299, 12, 1))
+
+
+@functools.lru_cache(maxsize=None)
+def get_imm_table() -> np.ndarray:
+    months = np.arange(np.datetime64(imm_table_range[0], 'M'), np.datetime64(imm_table_range[1], 'M') + 1, 3)
+    table = datetime64_to_exceldates(third_wednesdays(months))
+    table.setflags(write=False)
+    return table
+
+
+def next_imm_dates(d, n: int = 1) -> np.ndarray:
+    # Array version of next_imm_date, takes and returns excel dates. Returns n-th IMM date after each date.
+    d = np.asarray(d).astype(np.int64)
+    if n <= 0:
+        return d
+    table = get_imm_table()
+    ix = np.searchsorted(table, d, side='right') + (n - 1)
+    if np.all(ix < len(table)):
+        return table[ix]
+    for i in range(n):
+        d = calc_next_imm_dates(d)
+    return d
+
+
+def calc_next_imm_dates(d) -> np.ndarray:
+    days = exceldates_to_datetime64(d)
+    months = days.astype('datetime64[M]')
+    imm_months = months + (2 - months.astype(np.int64) % 3)  # Months since epoch are 0 for January
+    imm_dates = datetime64_to_exceldates(third_wednesdays(imm_months))
+    next_quarter_imm_dates = datetime64_to_exceldates(third_wednesdays(imm_months + 3))
+    return np.where(imm_dates > np.asarray(d), imm_dates, next_quarter_imm_dates)
+
+
+def third_wednesdays(months) -> np.ndarray:
+    # Takes and returns numpy.datetime64. Epoch 1970-01-01 was Thursday, which is weekday 3 (Monday=0)
+    first_days = months.astype('datetime64[D]')
+    weekdays = (first_days.astype(np.int64) + 3) % 7
+    return first_days + (2 - weekdays) % 7 + 14
+
+
+def add_months(d, months, preserve_eom: bool = False) -> np.ndarray:
+    # Day of month is kept, or capped at the end of the month (like relativedelta)
+    days = exceldates_to_datetime64(d)
+    start_months = days.astype('datetime64[M]')
+    day_of_month = (days - start_months.astype('datetime64[D]')).astype(np.int64)
+    end_months = start_months + np.asarray(months, dtype=np.int64)
+    end_days = end_months.astype('datetime64[D]') + np.minimum(day_of_month, month_lengths(end_months) - 1)
+    out = datetime64_to_exceldates(end_days)
+    if preserve_eom:
+        out = apply_eom(days, out)
+    return out
+
+
+def month_lengths(months) -> np.ndarray:
+    return ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(np.int64)
+
+
+def apply_eom(days_from, d_to) -> np.ndarray:
+    # Moves dates d_to to the end of month, where corresponding original dates are at the end of month
+    is_eom = (days_from + 1).astype('datetime64[M]') != days_from.astype('datetime64[M]')
+    end_of_months = datetime64_to_exceldates((exceldates_to_datetime64(d_to).astype('datetime64[M]') + 1)
+                                             .astype('datetime64[D]') - 1)
+    return np.where(is_eom, end_of_months, d_to)
+
+
+def date_step_array(dates, tenor: Tenor, preserve_eom: bool = False) -> np.ndarray:
+    # Steps all dates by the same tenor, same results as date_step for each element
     assert tenor.unit != 'E'
-    pydate = exceldate_to_pydate(date)
+    dates = np.asarray(dates).astype(np.int64)
     if tenor.unit == 'F':
-        pydate2 = pydate
-        for i in range(tenor.n):
-            pydate2 = next_imm_date(pydate2)
-    else:
-        pydate2 = pydate + create_relativedelta(tenor.n, tenor.unit)
+        assert not preserve_eom
+        return next_imm_dates(dates, tenor.n)
+    if tenor.unit == 'D':
+        out = dates + tenor.n
+        check_exceldates(out)
+        if preserve_eom:
+            out = apply_eom(exceldates_to_datetime64(dates), out)
+        return out
+    return add_months(dates, tenor.n * months_per_unit[tenor.unit], preserve_eom)
+
+
+def date_step_tenors(date: int, tenors, preserve_eom: bool = False) -> np.ndarray:
+    # Steps one date by each of the tenors
+    tenors = [t if isinstance(t, Tenor) else Tenor(t) for t in tenors]
+    if any(t.unit in ['F', 'E'] for t in tenors):
+        return np.array([date_step(date, t, preserve_eom) for t in tenors], dtype=np.int64)
+    months = np.array([t.n * months_per_unit.get(t.unit, 0) for t in tenors], dtype=np.int64)
+    days = np.array([t.n if t.unit == 'D' else 0 for t in tenors], dtype=np.int64)
+    out = add_months(np.full(len(tenors), date) + days, months)
     if preserve_eom:
-        assert tenor.unit not in ['F']
-        lastDay = calendar.monthrange(pydate.year, pydate.month)[1]
-        if pydate.day == lastDay:
-            d2 = calendar.monthrange(pydate2.year, pydate2.month)[1]
-            pydate2 = datetime.date(pydate2.year, pydate2.month, d2)
-    date2 = pydate_to_exceldate(pydate2)
-    return date2
+        out = apply_eom(exceldates_to_datetime64(np.full(len(tenors), date)), out)
+    return out
+
+
+months_per_unit = {'M': 1, 'Q': 3, 'Y': 12}
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def date_step(date: int, tenor: Tenor, preserve_eom: bool = False):
+    return int(date_step_array(date, tenor, preserve_eom))
 
 
 def date_roll(date, roll_type, calendar):
-    assert isinstance(date, int)
+    # Date can be a single date or an array of dates, which are all rolled at once using business day lookups
+    # of the calendar. Modified roll types fall back to the opposite direction when rolling would change the month.
     assert isinstance(roll_type, RollType)
-    if roll_type == RollType.FOLLOWING:
-        while calendar.is_holiday(date): date += 1
+    if roll_type == RollType.NONE:
         return date
+    if roll_type == RollType.FOLLOWING:
+        out = calendar.get_following_business_days(date)
     elif roll_type == RollType.PRECEDING:
-        while calendar.is_holiday(date): date -= 1
-        return date
+        out = calendar.get_preceding_business_days(date)
+    elif roll_type == RollType.MODIFIED_FOLLOWING:
+        following = calendar.get_following_business_days(date)
+        out = np.where(is_same_month(following, date), following, calendar.get_preceding_business_days(date))
+    elif roll_type == RollType.MODIFIED_PRECEDING:
+        preceding = calendar.get_preceding_business_days(date)
+        out = np.where(is_same_month(preceding, date), preceding, calendar.get_following_business_days(date))
     else:
-        raise BaseException("Roll type %s not implemented", roll_type)
+        raise BaseException("Roll type %s not implemented" % roll_type)
+    return int(out) if np.ndim(out) == 0 else out
+
+
+def is_same_month(d1, d2) -> np.ndarray:
+    return exceldates_to_datetime64(d1).astype('datetime64[M]') == exceldates_to_datetime64(d2).astype('datetime64[M]')
 
 
 def calculate_spot_date(trade_date, spot_offset, calendar):
-    assert not calendar.is_holiday(trade_date)
-    spot_date = trade_date
-    tenor1D = Tenor('1D')
-    for i in range(spot_offset):
-        spot_date = date_step(spot_date, tenor1D, preserve_eom=False)
-        spot_date = date_roll(spot_date, RollType.FOLLOWING, calendar)
-    assert not calendar.is_holiday(spot_date)
-    return spot_date
+    # Trade date can be a scalar or an array of trade dates
+    assert np.all(calendar.is_business_day(trade_date))
+    return calendar.add_business_days(trade_date, spot_offset)
 
 
 
@@ -176,57 +315,76 @@ def calculate_dcf(date0, date1, dcc):
     return numerator / dcc.get_denominator()
 
 
+def step_sequence(date: int, tenor: Tenor, count: int) -> np.ndarray:
+    # Returns date followed by count dates, each of them stepped from the previous one by tenor. Unlike stepping
+    # date by multiples of tenor, day of month once capped at the end of a shorter month stays capped.
+    if tenor.unit == 'F':
+        out = [date]
+        for i in range(count):
+            out.append(date_step(out[-1], tenor))
+        return np.array(out, dtype=np.int64)
+    k = np.arange(count + 1)
+    if tenor.unit == 'D':
+        out = date + tenor.n * k
+        check_exceldates(out)
+        return out
+    day = exceldates_to_datetime64(date)
+    month = day.astype('datetime64[M]')
+    day_of_month = (day - month.astype('datetime64[D]')).astype(np.int64)
+    months = month + tenor.n * months_per_unit[tenor.unit] * k
+    days_of_month = np.minimum.accumulate(np.minimum(month_lengths(months) - 1, day_of_month))
+    return datetime64_to_exceldates(months.astype('datetime64[D]') + days_of_month)
+
+
+def count_steps(start: int, end: int, tenor: Tenor) -> int:
+    # Number of steps by tenor which is enough to get from start beyond end
+    assert tenor.n != 0, "Schedule cannot be generated with zero tenor %s" % tenor
+    if tenor.unit == 'D':
+        return abs(end - start) // abs(tenor.n) + 2
+    months = exceldates_to_datetime64(np.array([start, end])).astype('datetime64[M]').astype(np.int64)
+    return int(abs(months[1] - months[0]) // abs(tenor.n * months_per_unit.get(tenor.unit, 3))) + 2
+
+
+@functools.lru_cache(maxsize=1 << 12)
 def generate_schedule(start: int, end: int, step: Tenor, stub_type: StubType = FRONT_STUB_SHORT):
+    # Schedules are shared by all instruments which ask for the same one, so the returned array is read-only
+    out = calc_schedule(start, end, step, stub_type)
+    out.setflags(write=False)
+    return out
+
+
+def calc_schedule(start: int, end: int, step: Tenor, stub_type: StubType = FRONT_STUB_SHORT):
+    if stub_type in [StubType.STUB_NOT_ALLOWED, StubType.BACK_STUB_SHORT, StubType.BACK_STUB_LONG]:
+        assert step.n > 0, "Schedule cannot be generated with step %s" % step
+        forward = step_sequence(start, step, count_steps(start, end, step))
+        assert forward[-1] > end
+    elif stub_type in [StubType.FRONT_STUB_SHORT, StubType.FRONT_STUB_LONG]:
+        assert step.n > 0 and step.unit != 'F', "Schedule cannot be generated with step %s" % step
+        backward = step_sequence(end, -step, count_steps(start, end, step))
+        assert backward[-1] < start
+    #
     if stub_type == StubType.STUB_NOT_ALLOWED:
-        d = start
-        out = []
-        while d <= end:
-            out.append(d)
-            d = date_step(d, step)
+        out = forward[forward <= end]
         mismatch = out[-1] - end
         if mismatch != 0:
             raise BaseException(
                 "Function generate_schedule for start=%s, end=%s, step=%s results in unallowed stub (mismatch %i days)" %
                 (start, end, step.string, mismatch))
-        return np.array(out)
+        return out
     if stub_type == StubType.BACK_STUB_SHORT:
-        d = start
-        out = []
-        while d < end:
-            out.append(d)
-            d = date_step(d, step)
-        if out[-1] != end:
-            out.append(end)
-        return np.array(out)
+        out = forward[forward < end]
+        return np.append(out, end) if out[-1] != end else out
     elif stub_type == StubType.BACK_STUB_LONG:
-        d = start
-        out = []
-        while date_step(d, step) <= end:
-            out.append(d)
-            d = date_step(d, step)
-        if out[-1] != end:
-            out.append(end)
-        return np.array(out)
+        out = forward[:-1][forward[1:] <= end]
+        return np.append(out, end) if out[-1] != end else out
     elif stub_type == StubType.FRONT_STUB_SHORT:
-        d = end
-        out = []
-        stepinv = -step
-        while d > start:
-            out.append(d)
-            d = date_step(d, stepinv)
-        if out[-1] != start:
-            out.append(start)
-        return np.array(out[::-1])
+        out = backward[backward > start]
+        out = np.append(out, start) if out[-1] != start else out
+        return out[::-1].copy()
     elif stub_type == StubType.FRONT_STUB_LONG:
-        d = end
-        out = []
-        stepinv = -step
-        while date_step(d, stepinv) >= start:
-            out.append(d)
-            d = date_step(d, stepinv)
-        if out[-1] != start:
-            out.append(start)
-        return np.array(out[::-1])
+        out = backward[:-1][backward[1:] >= start]
+        out = np.append(out, start) if out[-1] != start else out
+        return out[::-1].copy()
     else:
         raise BaseException("Other stub types not supported")
 
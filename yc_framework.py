@@ -5,6 +5,8 @@ from numpy import seterr
 from yc_curvebuilder import *
 from yc_curve import *
 from yc_riskcalculator import *
+from yc_scenarioengine import *
+from yc_portfolio import *
 from copy import deepcopy
 import re, random
 
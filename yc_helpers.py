@@ -1,6 +1,12 @@
 # Copyright © 2017 Ondrej Martinsky, All rights reserved
 # http://github.com/omartinsky/pybor
 
+import os
+import tempfile
+
+import numpy as np
+
+
 def assertRaisesMessage(exception_class, lambda_function, message_substring):
     try:
         lambda_function()
@@ -34,4 +40,39 @@ def coalesce(*arg):
     for el in arg:
         if el is not None:
             return el
-    return None
\ No newline at end of file
+    return None
+
+
+class NpyDiskCache:
+    """
+    Directory of .npy files keyed by hash strings. Files are memory-mapped when read, and written atomically, so that
+    several processes on one machine can share the same directory.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, "%s.npy" % key)
+
+    def load(self, key: str):
+        # Missing or unreadable entry is a cache miss
+        try:
+            return np.load(self.get_path(key), mmap_mode='r')
+        except OSError:
+            return None
+
+    def store(self, key: str, array):
+        # Cache is optional, entry is not stored when the directory is not writable
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, self.get_path(key))
+        except OSError:
+            pass
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,154 @@
+# Copyright © 2017 Ondrej Martinsky, All rights reserved
+# http://github.com/omartinsky/pybor
+
+from collections import OrderedDict
+
+import numpy as np
+
+from instruments.base_instrument import InstrumentType
+from instruments.basisswap import BasisSwap
+from instruments.deposit import Deposit
+from instruments.instrument_table import InstrumentTable
+from instruments.swap import Swap
+from yc_convention import Convention
+
+# Single currency instrument types whose PV is linear in the rate, see InstrumentTable.calc_par_rates_and_annuities.
+# Cross currency trades are not supported, PV of their legs would have to be converted with FX rates.
+portfolio_instrument_types = [InstrumentType.DEPOSIT, InstrumentType.SWAP, InstrumentType.BASIS_SWAP]
+
+
+class PortfolioBatch:
+    def __init__(self, curves, positions, instruments, notionals, rates):
+        self.curves = curves  # Curves used by all trades of the batch
+        self.positions = positions  # Positions of the trades in the portfolio
+        self.table = InstrumentTable(instruments)
+        self.notionals = notionals
+        self.rates = rates
+
+
+def calc_batch_pvs(batch: PortfolioBatch, curvemap) -> np.ndarray:
+    par_rates, annuities = batch.table.calc_par_rates_and_annuities(curvemap)
+    return batch.notionals * annuities * (batch.rates - par_rates)
+
+
+# Curvemap of the worker process, it is sent once per worker by the pool initializer
+worker_curvemap = None
+
+
+def init_worker_curvemap(curvemap):
+    global worker_curvemap
+    worker_curvemap = curvemap
+
+
+def calc_worker_batch_pvs(batch: PortfolioBatch) -> np.ndarray:
+    return calc_batch_pvs(batch, worker_curvemap)
+
+
+class Portfolio:
+    """
+    Trades are instruments with a notional and a rate which the trade receives on the left leg (fixed rate of
+    a swap, spread over the left forecast curve of a basis swap, deposit rate). PV of a trade is
+    notional * annuity * (rate - par rate), negative notional pays the rate.
+    Trades are stored in columns and priced in batches of trades which use the same curves.
+    """
+
+    def __init__(self):
+        self.instruments = []
+        self.notionals = []
+        self.rates = []
+        self.curves = []
+        self.batches_ = None
+        self.batches_chunk_size_ = None
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def add_trade(self, instrument, notional: float, rate: float):
+        row = instrument.get_table_row()
+        if row['type'] not in portfolio_instrument_types:
+            raise BaseException("Instrument %s of type %s can not be added to portfolio" % (
+                instrument.get_name(), row['type'].name))
+        # Curves are kept sorted, so that trades using the same curves in different roles are in the same group
+        curves = set(row[column] for column in ['forecast_l', 'discount_l', 'forecast_r', 'discount_r']
+                     if row.get(column) is not None)
+        self.instruments.append(instrument)
+        self.notionals.append(float(notional))
+        self.rates.append(float(rate))
+        self.curves.append(tuple(sorted(curves)))
+        self.batches_ = None
+
+    def add_deposit(self, name: str, curve: str, trade_date: int, start, length, convention: Convention,
+                    notional: float, rate: float):
+        self.add_trade(Deposit(name, curve, trade_date, start, length, convention), notional, rate)
+
+    def add_swap(self, name: str, curve_forecast: str, curve_discount: str, trade_date: int, start, length,
+                 convention_fixed: Convention, convention_float: Convention, notional: float, fixed_rate: float):
+        self.add_trade(Swap(name, curve_forecast, curve_discount, trade_date, start, length, convention_fixed,
+                            convention_float), notional, fixed_rate)
+
+    def add_basis_swap(self, name: str, curve_discount: str, curve_forecast_l: str, curve_forecast_r: str,
+                       trade_date: int, start, length, convention_l: Convention, convention_r: Convention,
+                       notional: float, spread: float):
+        self.add_trade(BasisSwap(name, curve_discount, curve_forecast_l, curve_forecast_r, trade_date, start, length,
+                                 convention_l, convention_r), notional, spread)
+
+    def get_names(self):
+        return [i.get_name() for i in self.instruments]
+
+    def get_curve_groups(self):
+        # Returns curve groups in sorted order and group index of each trade
+        groups = sorted(set(self.curves))
+        group_index = dict((g, i) for i, g in enumerate(groups))
+        return groups, np.array([group_index[c] for c in self.curves], dtype=np.int64)
+
+    def get_batches(self, chunk_size: int = 10000):
+        # Trades are grouped by curves, large groups are split into batches of at most chunk_size trades
+        if self.batches_ is not None and self.batches_chunk_size_ == chunk_size:
+            return self.batches_
+        groups, trade_groups = self.get_curve_groups()
+        order = np.argsort(trade_groups, kind='stable')
+        group_offsets = np.searchsorted(trade_groups[order], np.arange(len(groups) + 1))
+        notionals = np.array(self.notionals)
+        rates = np.array(self.rates)
+        batches = []
+        for g, curves in enumerate(groups):
+            for i in range(group_offsets[g], group_offsets[g + 1], chunk_size):
+                positions = order[i:min(i + chunk_size, group_offsets[g + 1])]
+                batches.append(PortfolioBatch(curves, positions, [self.instruments[p] for p in positions],
+                                              notionals[positions], rates[positions]))
+        self.batches_ = batches
+        self.batches_chunk_size_ = chunk_size
+        return batches
+
+    def calc_pvs(self, curvemap, processes=None, chunk_size: int = 10000) -> np.ndarray:
+        # Returns PV of each trade, ordered as trades were added. Batches are priced in a process pool
+        # when processes is given, curvemap is then sent to each worker process once.
+        batches = self.get_batches(chunk_size)
+        if processes is None or processes == 1:
+            batch_pvs = [calc_batch_pvs(b, curvemap) for b in batches]
+        else:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=init_worker_curvemap,
+                                                        initargs=(curvemap,)) as executor:
+                batch_pvs = list(executor.map(calc_worker_batch_pvs, batches,
+                                              chunksize=max(1, -(-len(batches) // processes))))
+        shape = batch_pvs[0].shape[:-1] if batch_pvs else ()
+        pvs = np.zeros(shape + (len(self),))
+        for batch, pv in zip(batches, batch_pvs):
+            pvs[..., batch.positions] = pv
+        return pvs
+
+    def calc_group_pvs(self, curvemap, processes=None, chunk_size: int = 10000) -> OrderedDict:
+        # Returns PV of trades aggregated by curves they use
+        pvs = self.calc_pvs(curvemap, processes, chunk_size)
+        groups, trade_groups = self.get_curve_groups()
+        if len(groups) == 0:
+            return OrderedDict()
+        order = np.argsort(trade_groups, kind='stable')
+        group_offsets = np.searchsorted(trade_groups[order], np.arange(len(groups)))
+        group_pvs = np.add.reduceat(pvs[..., order], group_offsets, axis=-1)
+        return OrderedDict((g, group_pvs[..., i]) for i, g in enumerate(groups))
+
+    def calc_pv(self, curvemap, processes=None, chunk_size: int = 10000):
+        # Total PV, can be used as pricer of RiskCalculator.calc_portfolio_gradient
+        return np.sum(self.calc_pvs(curvemap, processes, chunk_size), axis=-1)
@@ -0,0 +1,38 @@
+# Copyright © 2017 Ondrej Martinsky, All rights reserved
+# http://github.com/omartinsky/pybor
+
+import hashlib
+
+import numpy as np
+
+from yc_helpers import NpyDiskCache
+
+
+class RiskDiskCache(NpyDiskCache):
+    """
+    Persistent store of bumped curvemaps. Each entry holds only the vector of curve DOFs (raw float64 .npy file),
+    the curve structure is always taken from the base build output. Files are memory-mapped when read, and written
+    atomically, so that several processes on one machine can share the same directory.
+    """
+
+    @staticmethod
+    def create_base_key(curve_engine, build_output) -> str:
+        h = hashlib.sha1()
+        h.update(curve_engine.df_curves.to_csv().encode())
+        h.update(curve_engine.df_instruments.to_csv().encode())
+        h.update(repr(int(curve_engine.eval_date)).encode())
+        for name, price in sorted(build_output.input_prices.items()):
+            h.update(("%s=%r;" % (name, float(price))).encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def create_key(base_key: str, instrument_list, par_rate_bump_amount, bump_type) -> str:
+        h = hashlib.sha1()
+        h.update(base_key.encode())
+        h.update(";".join(sorted(instrument_list)).encode())
+        h.update(("%r;%s" % (float(par_rate_bump_amount), bump_type.name)).encode())
+        return h.hexdigest()
+
+    def store(self, key: str, dofs):
+        # Results are still returned when the directory is not writable
+        super(RiskDiskCache, self).store(key, np.ascontiguousarray(dofs, dtype=np.float64))
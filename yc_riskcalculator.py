@@ -4,11 +4,13 @@
 import copy
 import enum
 import re
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 
+from yc_curve import BumpedCurveMap
 from yc_curvebuilder import BuildOutput, CurveBuilder
+from yc_riskcache import RiskDiskCache
 
 
 class BumpType(enum.Enum):
@@ -21,12 +23,17 @@ JACOBIAN_REBUILD = BumpType.JACOBIAN_REBUILD
 
 
 class RiskCalculator:
-    def __init__(self, curve_engine, build_output: BuildOutput):
+    def __init__(self, curve_engine, build_output: BuildOutput, cache_dir: Optional[str] = None):
         assert isinstance(curve_engine, CurveBuilder)
         assert isinstance(build_output, BuildOutput)
         self.curve_engine = curve_engine
         self.build_output = build_output
         self.cache = dict()
+        self.jacobian_dPdI = None
+        self.disk_cache = None
+        if cache_dir is not None:
+            self.disk_cache = RiskDiskCache(cache_dir)
+            self.disk_cache_base_key = RiskDiskCache.create_base_key(curve_engine, build_output)
 
     def find_instruments(self, instrument_regex):
         bumped_instruments = list()
@@ -38,6 +45,19 @@ class RiskCalculator:
         return bumped_instruments
 
     def get_bumped_curvemap(self, instrument_list, par_rate_bump_amount, bump_type):
+        if self.disk_cache is None:
+            return self.calc_bumped_curvemap(instrument_list, par_rate_bump_amount, bump_type)
+
+        key = RiskDiskCache.create_key(self.disk_cache_base_key, instrument_list, par_rate_bump_amount, bump_type)
+        dofs = self.disk_cache.load(key)
+        if dofs is not None:
+            return self.create_curvemap_from_dofs(dofs)
+
+        curvemap = self.calc_bumped_curvemap(instrument_list, par_rate_bump_amount, bump_type)
+        self.disk_cache.store(key, curvemap.get_all_dofs(curvemap.keys()))
+        return curvemap
+
+    def calc_bumped_curvemap(self, instrument_list, par_rate_bump_amount, bump_type):
         if bump_type == BumpType.FULL_REBUILD:
             return self.get_bumped_curvemap_full(instrument_list, par_rate_bump_amount)
         elif bump_type == BumpType.JACOBIAN_REBUILD:
@@ -45,23 +65,43 @@ class RiskCalculator:
         else:
             raise BaseException("Unknown bump type")
 
+    def create_curvemap_from_dofs(self, dofs):
+        curvemap = BumpedCurveMap(self.build_output.output_curvemap)
+        all_curves = curvemap.keys()
+        if len(dofs) != len(curvemap.get_all_dofs(all_curves)):
+            raise BaseException("Cached risk result does not match the structure of the curvemap")
+        curvemap.set_all_dofs(all_curves, dofs)
+        return curvemap
+
     def get_bumped_curvemap_full(self, instrument_list, par_rate_bump_amount):
+        return self.get_bumped_build_output_full(instrument_list, par_rate_bump_amount).output_curvemap
+
+    def get_bumped_build_output_full(self, instrument_list, par_rate_bump_amount):
 
         key = (tuple(instrument_list), par_rate_bump_amount)
 
         if key in self.cache:
             return self.cache[key]
 
+        par_rate_shifts = dict((name, par_rate_bump_amount) for name in instrument_list)
+        bumped_build_output = self.get_shifted_build_output_full(par_rate_shifts)
+        self.cache[key] = bumped_build_output
+        return bumped_build_output
+
+    def get_shifted_build_output_full(self, par_rate_shifts):
+        # Full rebuild after shifting par rates of instruments by different amounts (instrument name -> shift)
         bumped_prices = copy.deepcopy(self.build_output.input_prices)
         for name, value in bumped_prices.items():
-            if name in instrument_list:
+            if name in par_rate_shifts:
                 drdp = self.curve_engine.get_instrument_by_name(name).drdp()
-                price_bump_amount = par_rate_bump_amount * drdp
+                price_bump_amount = par_rate_shifts[name] * drdp
                 bumped_prices[name] += price_bump_amount
 
-        bumped_build_output = self.curve_engine.build_curves(bumped_prices)
-        self.cache[key] = bumped_build_output.output_curvemap
-        return bumped_build_output.output_curvemap
+        # Stages which do not contain bumped instruments are not affected and are not solved again
+        first_stage = self.curve_engine.get_first_affected_stage(list(par_rate_shifts.keys()))
+        return self.curve_engine.build_curves(bumped_prices,
+                                              solved_curvemap=self.build_output.output_curvemap,
+                                              first_stage=first_stage)
 
     def get_bumped_curvemap_jacobian(self,
                                      instrument_list: List,
@@ -72,13 +112,78 @@ class RiskCalculator:
             ix = instrument_names.index(instrument_name)
             par_rate_bumps[ix] = par_rate_bump_amount
 
-        jacobian_dPdI = np.linalg.pinv(self.build_output.jacobian_dIdP)
-        curvemap_bumped = copy.deepcopy(self.build_output.output_curvemap)
+        jacobian_dPdI = self.get_jacobian_dPdI()
+        curvemap_bumped = BumpedCurveMap(self.build_output.output_curvemap)
 
         responses = np.dot(par_rate_bumps, jacobian_dPdI)
 
-        dfs = curvemap_bumped.get_all_dofs(curvemap_bumped.keys())
-        dfs += responses
-        curvemap_bumped.set_all_dofs(curvemap_bumped.keys(), dfs)
+        curvemap_bumped.set_all_dofs_deltas(curvemap_bumped.keys(), responses)
 
         return curvemap_bumped
+
+    def get_jacobian_dPdI(self):
+        # Rows=Instruments   Cols=Pillars
+        if self.jacobian_dPdI is None:
+            self.jacobian_dPdI = np.linalg.pinv(self.build_output.jacobian_dIdP)
+        return self.jacobian_dPdI
+
+    def get_instrument_names(self):
+        return [i.get_name() for i in self.build_output.instruments]
+
+    def calc_portfolio_gradient(self, pricer, curvemap=None, bump_size=1e-8):
+        # Finite-difference gradient of portfolio value with respect to curve DOFs.
+        # Pricer is a function curvemap -> value, value can be a scalar or a vector of trade values.
+        # Returned gradient has Rows=Pillars (and Cols=Trades for vector valued pricers)
+        curvemap = self.build_output.output_curvemap if curvemap is None else curvemap
+        all_curves = curvemap.keys()
+        dofs_count = len(curvemap.get_all_dofs(all_curves))
+        v0 = np.asarray(pricer(curvemap))
+        gradient = np.zeros((dofs_count,) + v0.shape)
+        bump_vector = np.zeros(dofs_count)
+        for i in range(dofs_count):
+            bump_vector[i] = bump_size
+            curvemap_bumped = BumpedCurveMap(curvemap)
+            curvemap_bumped.set_all_dofs_deltas(all_curves, bump_vector)
+            gradient[i] = (np.asarray(pricer(curvemap_bumped)) - v0) / bump_size
+            bump_vector[i] = 0.
+        return gradient
+
+    def get_portfolio_delta(self, portfolio_gradient):
+        # Chain rule dV/dI = dP/dI . dV/dP, where dV/dP is either finite-difference (see calc_portfolio_gradient)
+        # or analytic gradient of the portfolio. Rows of the output are ordered as self.get_instrument_names(),
+        # deltas are expressed per unit change of instrument par rate.
+        portfolio_gradient = np.asarray(portfolio_gradient)
+        jacobian_dPdI = self.get_jacobian_dPdI()
+        if portfolio_gradient.shape[0] != jacobian_dPdI.shape[1]:
+            raise BaseException("Portfolio gradient has %i rows, expected one row per curve pillar (%i)" % (
+                portfolio_gradient.shape[0], jacobian_dPdI.shape[1]))
+        return np.dot(jacobian_dPdI, portfolio_gradient)
+
+    def get_portfolio_gamma(self, pricer, instrument_list=None, par_rate_bump_amount=1e-4, sparse=False,
+                            threshold=0.):
+        # Cross-gamma d2V/dIdI of a portfolio. Pricer is a function curvemap -> scalar portfolio value.
+        # Each row is a difference of portfolio deltas (chain rule against the base and the bumped Jacobian),
+        # so only one partial rebuild per instrument is needed instead of nested full rebuilds.
+        # Rows and columns are ordered as instrument_list, diagonal gamma is the diagonal of the output.
+        instrument_names = self.get_instrument_names()
+        instrument_list = instrument_names if instrument_list is None else list(instrument_list)
+        ix = [instrument_names.index(name) for name in instrument_list]
+
+        delta0 = self.get_portfolio_delta(self.calc_portfolio_gradient(pricer))
+        if delta0.ndim != 1:
+            raise BaseException("Pricer must return a scalar portfolio value")
+
+        gamma = np.zeros((len(instrument_list), len(instrument_list)))
+        for row, name in enumerate(instrument_list):
+            bumped_build_output = self.get_bumped_build_output_full([name], par_rate_bump_amount)
+            jacobian_dPdI = np.linalg.pinv(bumped_build_output.jacobian_dIdP)
+            gradient = self.calc_portfolio_gradient(pricer, bumped_build_output.output_curvemap)
+            delta = np.dot(jacobian_dPdI, gradient)
+            gamma[row] = (delta[ix] - delta0[ix]) / par_rate_bump_amount
+        gamma = (gamma + gamma.T) / 2.
+
+        if sparse:
+            import scipy.sparse
+            gamma[abs(gamma) <= threshold] = 0.
+            return scipy.sparse.csr_matrix(gamma)
+        return gamma
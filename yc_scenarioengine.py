@@ -0,0 +1,104 @@
+# Copyright © 2017 Ondrej Martinsky, All rights reserved
+# http://github.com/omartinsky/pybor
+
+import numpy as np
+
+from yc_curve import BumpedCurveMap, Curve, CurveMap, ScenarioCurve
+from yc_riskcalculator import RiskCalculator
+
+
+class ScenarioEngine:
+    """
+    Applies historical (or any other) par-rate scenarios to the calibration instruments. Scenarios are given as a
+    matrix with Rows=Scenarios and Cols=Instruments (ordered as RiskCalculator.get_instrument_names()) and are mapped
+    to curve DOF responses through the cached dP/dI of the risk calculator. Scenarios are processed in chunks of
+    fixed size, so the shift matrix can also be a numpy memmap with many more scenarios than fit in memory.
+    Each chunk is priced at once, through a curvemap of ScenarioCurves holding all scenarios of the chunk.
+    """
+
+    def __init__(self, risk_calculator: RiskCalculator, chunk_size: int = 1000):
+        assert isinstance(risk_calculator, RiskCalculator)
+        assert chunk_size > 0
+        self.risk_calculator = risk_calculator
+        self.chunk_size = chunk_size
+
+    def check_shifts(self, par_rate_shifts):
+        instrument_count = len(self.risk_calculator.get_instrument_names())
+        if par_rate_shifts.ndim != 2 or par_rate_shifts.shape[1] != instrument_count:
+            raise BaseException("Scenario matrix has shape %s, expected (scenarios x %i instruments)" % (
+                str(par_rate_shifts.shape), instrument_count))
+
+    def iter_dofs_responses(self, par_rate_shifts):
+        # Yields tuples (index of first scenario in chunk, DOF responses with Rows=Scenarios Cols=Pillars)
+        self.check_shifts(par_rate_shifts)
+        jacobian_dPdI = self.risk_calculator.get_jacobian_dPdI()
+        for start in range(0, par_rate_shifts.shape[0], self.chunk_size):
+            chunk = np.asarray(par_rate_shifts[start:start + self.chunk_size], dtype=np.float64)
+            yield start, np.dot(chunk, jacobian_dPdI)
+
+    def create_scenario_curvemap(self, dofs_responses):
+        # Curvemap of ScenarioCurves with Rows=Scenarios, one scenario per row of DOF responses
+        base_curvemap = self.risk_calculator.build_output.output_curvemap
+        curvemap = CurveMap()
+        i = 0
+        for name in base_curvemap.keys():
+            curve = base_curvemap[name]
+            assert type(curve) is Curve, "Curve %s can not be converted to scenario curve" % name
+            j = i + curve.get_dofs_count()
+            curvemap.add_curve(ScenarioCurve(name, curve.times_[0], curve.times_[1:],
+                                             curve.get_all_dofs() + dofs_responses[:, i:j], curve.interpolation_mode_))
+            i = j
+        return curvemap
+
+    def iter_scenario_curvemaps(self, par_rate_shifts):
+        # Yields tuples (index of first scenario in chunk, curvemap of ScenarioCurves for all scenarios in chunk)
+        for start, responses in self.iter_dofs_responses(par_rate_shifts):
+            yield start, self.create_scenario_curvemap(responses)
+
+    def iter_curvemaps(self, par_rate_shifts):
+        base_curvemap = self.risk_calculator.build_output.output_curvemap
+        all_curves = base_curvemap.keys()
+        for start, responses in self.iter_dofs_responses(par_rate_shifts):
+            for response in responses:
+                curvemap = BumpedCurveMap(base_curvemap)
+                curvemap.set_all_dofs_deltas(all_curves, response)
+                yield curvemap
+
+    def calc_scenario_values(self, pricer, par_rate_shifts):
+        # Pricer is a function curvemap -> portfolio value. It is called once per chunk with a curvemap of
+        # ScenarioCurves and returns one value per scenario of the chunk, output has one value per scenario.
+        values = np.zeros(par_rate_shifts.shape[0])
+        for start, curvemap in self.iter_scenario_curvemaps(par_rate_shifts):
+            values[start:start + self.chunk_size] = pricer(curvemap)
+        return values
+
+    def calc_scenario_pnl(self, pricer, par_rate_shifts):
+        v0 = pricer(self.risk_calculator.build_output.output_curvemap)
+        return self.calc_scenario_values(pricer, par_rate_shifts) - v0
+
+    @staticmethod
+    def calc_var(scenario_pnl, confidence: float = 0.99):
+        return -np.percentile(scenario_pnl, 100. * (1. - confidence))
+
+    def validate(self, par_rate_shifts, sample_size: int = 10, seed=None):
+        # Compares Jacobian scenario curves against full rebuild on a random subset of scenarios.
+        # Returns indices of sampled scenarios and maximum absolute DOF error for each of them.
+        self.check_shifts(par_rate_shifts)
+        scenario_count = par_rate_shifts.shape[0]
+        rng = np.random.default_rng(seed)
+        indices = np.sort(rng.choice(scenario_count, size=min(sample_size, scenario_count), replace=False))
+
+        instrument_names = self.risk_calculator.get_instrument_names()
+        jacobian_dPdI = self.risk_calculator.get_jacobian_dPdI()
+        base_curvemap = self.risk_calculator.build_output.output_curvemap
+        all_curves = base_curvemap.keys()
+        base_dofs = base_curvemap.get_all_dofs(all_curves)
+        errors = np.zeros(len(indices))
+        for i, ix in enumerate(indices):
+            shifts = np.asarray(par_rate_shifts[ix], dtype=np.float64)
+            par_rate_shifts_dict = dict((name, shift) for name, shift in zip(instrument_names, shifts) if shift != 0.)
+            build_output = self.risk_calculator.get_shifted_build_output_full(par_rate_shifts_dict)
+            dofs_full = build_output.output_curvemap.get_all_dofs(all_curves)
+            dofs_jacobian = base_dofs + np.dot(shifts, jacobian_dPdI)
+            errors[i] = np.max(np.abs(dofs_full - dofs_jacobian))
+        return indices, errors